@@ -3,7 +3,7 @@ from .models import Article, Rating
 
 
 class ArticleAdmin(admin.ModelAdmin):
-    list_display = ('id', 'title', 'created_at', 'updated_at', 'ratings_count', 'avg_rating')
+    list_display = ('id', 'title', 'created_at', 'updated_at', 'ratings_count', 'total_score', 'avg_rating')
     search_fields = ('title', 'content')
     list_filter = ('created_at',)
 
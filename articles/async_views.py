@@ -0,0 +1,117 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import JsonResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.settings import api_settings
+
+from utils.article_cache_utils import async_get_user_ratings, get_articles_page
+from utils.article_ids_utils import async_article_exists
+from utils.async_redis_utils import async_enqueue_ratings
+from utils.rate_limit_utils import async_check_rating_admission
+from .views import article_results, parse_rating, split_articles_page
+
+
+def _in_thread_pool(func):
+    # Thread sensitive calls (the sync_to_async default, also used by cache.aget) all run in one shared thread, which
+    # would serialize the requests of a worker. The pool threads' database connections are not closed at the end of
+    # a request, so expired or broken ones are closed around every call.
+    def call(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(call, thread_sensitive=False)
+
+
+def _authenticate(request):
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        result = authentication_class().authenticate(request)
+        if result is not None:
+            return result[0]
+    return None
+
+
+# Plain Django async views: DRF views are sync only, so authentication reuses the DRF authentication classes
+# (run in a thread pool, as they may query the database) and responses keep the same JSON shape as the DRF views.
+class AsyncAPIView(View):
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            user = await _in_thread_pool(_authenticate)(request)
+        except APIException as e:
+            detail = e.detail if isinstance(e.detail, dict) else {"detail": e.detail}
+            return JsonResponse(detail, status=e.status_code)
+
+        if user is None:
+            return JsonResponse({"detail": "Authentication credentials were not provided."},
+                                status=status.HTTP_401_UNAUTHORIZED)
+
+        request.user = user
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class AsyncArticleListView(AsyncAPIView):
+
+    async def get(self, request, *args, **kwargs):
+        cursor = request.GET.get('cursor', '0')
+
+        if not cursor.isdigit():
+            return JsonResponse({"detail": "Cursor must be a valid integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        cursor = int(cursor)
+        page_size = settings.ARTICLES_PAGE_SIZE
+
+        try:
+            articles = await _in_thread_pool(get_articles_page)(cursor, page_size)
+        except Exception as e:
+            return JsonResponse({"detail": f"Error fetching articles: {str(e)}"},
+                                status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        articles, next_url = split_articles_page(request, articles, page_size)
+
+        try:
+            user_ratings = await async_get_user_ratings(request.user.id, [article[0] for article in articles])
+        except Exception as e:
+            return JsonResponse({"detail": f"Error fetching user rating: {str(e)}"},
+                                status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return JsonResponse({"next": next_url, "results": article_results(articles, user_ratings)},
+                            status=status.HTTP_200_OK)
+
+
+class AsyncRatingCreateView(AsyncAPIView):
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({"detail": "Request body must be valid JSON."}, status=status.HTTP_400_BAD_REQUEST)
+
+        article_id, score, error = parse_rating(data)
+
+        if error:
+            return JsonResponse({"detail": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        rejection = await async_check_rating_admission(request.user.id, [article_id])
+        if rejection:
+            status_code, detail, retry_after = rejection
+            return JsonResponse({"detail": detail}, status=status_code, headers={'Retry-After': str(retry_after)})
+
+        if not await async_article_exists(article_id):
+            return JsonResponse({"detail": f"Article {article_id} not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        await async_enqueue_ratings(request.user.id, [(article_id, score)])
+
+        return JsonResponse({"detail": "Rating added successfully."}, status=status.HTTP_201_CREATED)
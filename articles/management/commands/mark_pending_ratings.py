@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from utils.redis_utils import mark_pending_articles_dirty
+
+
+class Command(BaseCommand):
+    help = "Mark every article with ratings queued in Redis as dirty so the rating tasks pick it up."
+
+    def handle(self, *args, **options):
+        marked = mark_pending_articles_dirty()
+        self.stdout.write(self.style.SUCCESS(f"Marked {marked} rating queues as pending."))
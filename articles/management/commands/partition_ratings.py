@@ -0,0 +1,55 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from articles.models import Article
+from utils.article_cache_utils import update_article_in_cache
+from utils.partition_utils import (create_rating_partitions, detach_rating_partitions, is_rating_table_partitioned,
+                                   setup_rating_partitions)
+
+
+class Command(BaseCommand):
+    help = "Manage the monthly PostgreSQL partitions of the Rating table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--setup', action='store_true',
+                            help="Convert the Rating table into a table partitioned by month (locks the table).")
+        parser.add_argument('--months-ahead', type=int, default=settings.RATING_PARTITION_MONTHS_AHEAD,
+                            help="Number of future monthly partitions to create.")
+        parser.add_argument('--detach-before', metavar='YYYY-MM',
+                            help="Detach the partitions holding only ratings created before this month.")
+        parser.add_argument('--drop', action='store_true', help="Drop detached partitions instead of keeping them.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Rating partitioning requires PostgreSQL.")
+
+        before = None
+        if options['detach_before']:
+            try:
+                before = datetime.datetime.strptime(options['detach_before'], '%Y-%m').replace(
+                    tzinfo=datetime.timezone.utc)
+            except ValueError:
+                raise CommandError("--detach-before must be a month in the YYYY-MM format.")
+
+        if options['setup']:
+            if is_rating_table_partitioned():
+                raise CommandError("The Rating table is already partitioned.")
+            setup_rating_partitions(options['months_ahead'])
+            self.stdout.write(self.style.SUCCESS(
+                "Partitioned the Rating table, set RATING_PARTITIONING_ENABLED=True before processing ratings."
+            ))
+        elif not is_rating_table_partitioned():
+            raise CommandError("The Rating table is not partitioned, run the command with --setup first.")
+
+        created = create_rating_partitions(options['months_ahead'])
+        self.stdout.write(self.style.SUCCESS(f"Created {len(created)} rating partitions."))
+
+        if before is not None:
+            detached, article_ids = detach_rating_partitions(before, drop=options['drop'])
+            for article in Article.objects.filter(pk__in=article_ids).defer('content'):
+                update_article_in_cache(article)
+            action = "Dropped" if options['drop'] else "Detached"
+            self.stdout.write(self.style.SUCCESS(f"{action} {len(detached)} rating partitions: {', '.join(detached)}"))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from articles.models import Article, Rating
+from utils.article_cache_utils import update_article_in_cache
+
+
+class Command(BaseCommand):
+    help = "Recompute ratings_count, total_score and avg_rating of every article from the Rating table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        rebuilt = 0
+
+        while True:
+            # The batch is locked before aggregating, so a rating task committing to one of these articles either
+            # finishes first (its ratings are counted) or applies its delta after the rebuilt values are written.
+            with transaction.atomic():
+                articles = list(Article.objects.select_for_update().filter(pk__gt=last_id).order_by('pk').only(
+                    'id', 'title', 'ratings_count', 'total_score', 'avg_rating'
+                )[:batch_size])
+                if not articles:
+                    break
+
+                aggregates = {
+                    row['article_id']: row
+                    for row in Rating.objects.filter(article__in=articles).values('article_id').annotate(
+                        total=Sum('score'), count=Count('id')
+                    )
+                }
+
+                for article in articles:
+                    row = aggregates.get(article.pk, {'total': 0, 'count': 0})
+                    article.total_score = row['total']
+                    article.ratings_count = row['count']
+                    article.avg_rating = Article.calculate_avg_rating(row['total'], row['count'])
+
+                Article.objects.bulk_update(articles, ['total_score', 'ratings_count', 'avg_rating'])
+
+            for article in articles:
+                update_article_in_cache(article)
+
+            rebuilt += len(articles)
+            last_id = articles[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt aggregates for {rebuilt} articles."))
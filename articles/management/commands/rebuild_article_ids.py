@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from utils.article_ids_utils import rebuild_article_ids
+
+
+class Command(BaseCommand):
+    help = "Rebuild the Redis set of article ids used to validate ratings."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        rebuild_article_ids(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS("Rebuilt the article id set."))
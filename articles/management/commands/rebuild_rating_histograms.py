@@ -0,0 +1,23 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from articles.models import Rating
+from utils.histogram_utils import HISTOGRAM_HOURS, rebuild_histograms
+
+
+class Command(BaseCommand):
+    help = "Rebuild the hourly rating histograms in Redis from the recent rows of the Rating table."
+
+    def handle(self, *args, **options):
+        since = timezone.now() - datetime.timedelta(hours=HISTOGRAM_HOURS)
+        rows = Rating.objects.filter(created_at__gte=since).annotate(hour=TruncHour('created_at')).values(
+            'article_id', 'hour', 'score'
+        ).annotate(count=Count('id')).values_list('article_id', 'hour', 'score', 'count')
+
+        rows = list(rows)
+        rebuild_histograms(rows)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(rows)} hourly rating buckets."))
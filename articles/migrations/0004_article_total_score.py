@@ -0,0 +1,31 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:00
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_total_score(apps, schema_editor):
+    Article = apps.get_model('articles', 'Article')
+    Rating = apps.get_model('articles', 'Rating')
+
+    total_score = Rating.objects.filter(article=OuterRef('pk')).values('article').annotate(
+        total=Sum('score')
+    ).values('total')
+    Article.objects.update(total_score=Coalesce(Subquery(total_score), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('articles', '0003_rating_suspicion_factor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='total_score',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_total_score, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+from utils.migration_utils import AddIndexConcurrentlyIfSupported
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('articles', '0004_article_total_score'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyIfSupported(
+            model_name='rating',
+            index=models.Index(
+                fields=['article', 'created_at'], include=('score',), name='rating_article_created_idx'
+            ),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='rating',
+            index=models.Index(
+                fields=['user', '-created_at'], include=('article', 'score'), name='rating_user_created_idx'
+            ),
+        ),
+    ]
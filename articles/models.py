@@ -3,10 +3,16 @@ import logging
 from decimal import Decimal
 
 import numpy as np
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+from utils.histogram_utils import record_rating_changes
+from utils.partition_utils import lock_rating_articles
+from utils.profile_utils import record_user_ratings
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
@@ -17,18 +23,33 @@ class Article(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     ratings_count = models.PositiveIntegerField(default=0)
+    total_score = models.PositiveBigIntegerField(default=0)
     avg_rating = models.DecimalField(max_digits=4, decimal_places=2, default=Decimal('0.00'))
 
     def __str__(self):
         return self.title
 
-    def update_avg_rating(self, total_score, total_ratings):
+    @staticmethod
+    def calculate_avg_rating(total_score, total_ratings):
         avg_rating = Decimal(total_score) / Decimal(total_ratings) if total_ratings > 0 else Decimal('0.00')
-        avg_rating = avg_rating.quantize(Decimal('0.00'))
-        self.avg_rating = avg_rating
+        return avg_rating.quantize(Decimal('0.00'))
+
+    def update_avg_rating(self, total_score, total_ratings):
+        self.avg_rating = self.calculate_avg_rating(total_score, total_ratings)
+        self.total_score = total_score
         self.ratings_count = total_ratings
         self.save()
 
+    def apply_rating_delta(self, score_delta, ratings_delta):
+        articles = Article.objects.filter(pk=self.pk)
+        with transaction.atomic():
+            articles.update(total_score=F('total_score') + score_delta,
+                            ratings_count=F('ratings_count') + ratings_delta,
+                            updated_at=timezone.now())
+            self.refresh_from_db(fields=['total_score', 'ratings_count', 'updated_at'])
+            self.avg_rating = self.calculate_avg_rating(self.total_score, self.ratings_count)
+            articles.update(avg_rating=self.avg_rating)
+
 
 class Rating(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -39,19 +60,80 @@ class Rating(models.Model):
 
     class Meta:
         unique_together = ('user', 'article')
+        indexes = [
+            # Spike counts and recent score statistics of an article; score is included for index-only scans.
+            models.Index(fields=['article', 'created_at'], include=['score'], name='rating_article_created_idx'),
+            # A user's most recent ratings.
+            models.Index(fields=['user', '-created_at'], include=['article', 'score'], name='rating_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.article.title} - {self.score}"
 
     @classmethod
-    def update_or_create_rating(cls, user_id, article, score, suspicion_factor):
-        previous_rating = cls.objects.filter(user_id=user_id, article=article).first()
-        if previous_rating:
-            rating_diff = int(score) - previous_rating.score
-            previous_rating.score = int(score)
-            previous_rating.suspicion_factor = suspicion_factor
-            previous_rating.save(update_fields=['score', 'suspicion_factor'])
-            return rating_diff, 0
-        else:
-            cls.objects.create(user_id=user_id, article=article, score=int(score), suspicion_factor=suspicion_factor)
-            return int(score), 1
+    def bulk_upsert_ratings(cls, ratings):
+        latest = {}
+        for user_id, article_id, score, suspicion_factor in ratings:
+            latest[(int(user_id), int(article_id))] = (int(score), suspicion_factor)
+
+        if not latest:
+            return {}
+
+        with transaction.atomic():
+            # A first rating has no row to lock yet, so the new ratings are only known exactly while no other task
+            # upserts ratings of the same articles.
+            lock_rating_articles({article_id for _, article_id in latest})
+
+            previous_ratings = {
+                (user_id, article_id): (score, created_at, pk)
+                for pk, user_id, article_id, score, created_at in cls.objects.select_for_update().filter(
+                    user_id__in={user_id for user_id, _ in latest},
+                    article_id__in={article_id for _, article_id in latest},
+                ).values_list('pk', 'user_id', 'article_id', 'score', 'created_at')
+            }
+
+            if settings.RATING_PARTITIONING_ENABLED:
+                # The partitioned table has no (user, article) unique constraint to resolve conflicts against.
+                cls.objects.bulk_update(
+                    [cls(pk=previous_ratings[key][2], score=score, suspicion_factor=suspicion_factor)
+                     for key, (score, suspicion_factor) in latest.items() if key in previous_ratings],
+                    ['score', 'suspicion_factor'],
+                )
+                cls.objects.bulk_create(
+                    [cls(user_id=user_id, article_id=article_id, score=score, suspicion_factor=suspicion_factor)
+                     for (user_id, article_id), (score, suspicion_factor) in latest.items()
+                     if (user_id, article_id) not in previous_ratings],
+                )
+            else:
+                cls.objects.bulk_create(
+                    [cls(user_id=user_id, article_id=article_id, score=score, suspicion_factor=suspicion_factor)
+                     for (user_id, article_id), (score, suspicion_factor) in latest.items()],
+                    update_conflicts=True,
+                    unique_fields=['user', 'article'],
+                    update_fields=['score', 'suspicion_factor'],
+                )
+
+            deltas = {}
+            histogram_changes = []
+            profile_changes = []
+            now = timezone.now().timestamp()
+            for (user_id, article_id), (score, _) in latest.items():
+                score_delta, new_ratings = deltas.get(article_id, (0, 0))
+                if (user_id, article_id) in previous_ratings:
+                    previous_score, created_at, _ = previous_ratings[(user_id, article_id)]
+                    score_delta += score - previous_score
+                    if score != previous_score:
+                        histogram_changes.append((article_id, created_at.timestamp(), previous_score, -1))
+                        histogram_changes.append((article_id, created_at.timestamp(), score, 1))
+                    profile_changes.append((user_id, article_id, score, False))
+                else:
+                    score_delta += score
+                    new_ratings += 1
+                    histogram_changes.append((article_id, now, score, 1))
+                    profile_changes.append((user_id, article_id, score, True))
+                deltas[article_id] = (score_delta, new_ratings)
+
+            transaction.on_commit(lambda: record_rating_changes(histogram_changes))
+            transaction.on_commit(lambda: record_user_ratings(profile_changes))
+
+        return deltas
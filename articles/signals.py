@@ -0,0 +1,21 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from utils.article_ids_utils import add_article_ids, remove_article_ids
+from .models import Article
+
+
+@receiver(post_save, sender=Article)
+def add_article_id(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: add_article_ids([instance.pk]))
+
+
+@receiver(post_delete, sender=Article)
+def remove_article_id(sender, instance, **kwargs):
+    # Removed right away so new ratings are rejected, and again after commit in case a concurrent
+    # request re-added the id from the database before the delete was visible.
+    article_id = instance.pk
+    remove_article_ids([article_id])
+    transaction.on_commit(lambda: remove_article_ids([article_id]))
@@ -1,121 +1,213 @@
 import logging
-from celery import shared_task
+import os
+import socket
+
+from celery import group, shared_task
 from django.conf import settings
-from django.contrib.auth.models import User
+from django.db import transaction
+from redis.exceptions import LockError
 
-from utils.rating_utils import calculate_suspicion
+from utils.article_cache_utils import update_article_in_cache
+from utils.partition_utils import create_rating_partitions
+from utils.rating_utils import calculate_suspicion_batch
 from .models import Article, Rating
-from utils.redis_utils import get_ratings_from_redis, add_rating_to_redis, delete_user_rating_from_redis
+from utils.redis_utils import (get_ratings_from_redis, move_classified_ratings_in_redis, delete_ratings_from_redis,
+                               drop_article_ratings_from_redis, claim_dirty_articles, finish_dirty_articles,
+                               mark_articles_dirty, add_classified_ratings_to_redis, ensure_rating_stream_group,
+                               read_rating_stream, ack_rating_stream, get_rating_task_lock, count_dirty_articles)
 
 logger = logging.getLogger(__name__)
 
 
-@shared_task
-def process_unprocessed_ratings():
-    articles = Article.objects.all()
+def _commit_ratings(article, ratings, rating_type):
+    with transaction.atomic():
+        deltas = Rating.bulk_upsert_ratings(
+            (user_id, article.pk, rating_data['score'], rating_data['suspicion_factor'])
+            for user_id, rating_data in ratings
+        )
+        score_delta, new_ratings = deltas.get(article.pk, (0, 0))
+        article.apply_rating_delta(score_delta, new_ratings)
+
+    delete_ratings_from_redis(article.pk, ratings, rating_type=rating_type)
+
+    update_article_in_cache(article)
+
+
+def _process_dirty_articles(rating_type, shard, process_article, heartbeat=None):
+    # Each article is released only once its ratings are committed, so if the worker is killed the rest stay
+    # claimed and are picked up by the next run of the shard.
+    article_ids = claim_dirty_articles(rating_type, shard)
+    articles = list(Article.objects.filter(pk__in=article_ids).defer('content').order_by('pk'))
+
+    # The ratings of deleted articles are dropped, so they do not stay counted as pending forever.
+    deleted_ids = set(article_ids) - {article.pk for article in articles}
+    for article_id in deleted_ids:
+        drop_article_ratings_from_redis(article_id)
+    finish_dirty_articles(rating_type, shard, deleted_ids)
 
     for article in articles:
-        logger.info(f"Processing unprocessed ratings for article {article.title} (ID: {article.pk})")
+        process_article(article)
+        finish_dirty_articles(rating_type, shard, [article.pk])
+        if heartbeat:
+            heartbeat()
 
-        unprocessed_ratings = get_ratings_from_redis(article.pk, rating_type='unprocessed')
-        if not unprocessed_ratings:
-            continue
 
-        for user_id, rating_data in unprocessed_ratings.items():
-            score = rating_data['score']
-            user = User.objects.get(id=user_id)
+def _classify_ratings(article, ratings):
+    suspicion_factors = calculate_suspicion_batch(
+        article, {int(user_id): rating_data['score'] for user_id, rating_data in ratings.items()}
+    )
 
-            suspicion_factor = calculate_suspicion(score, user, article)
+    classified_ratings = []
+    for user_id, rating_data in ratings.items():
+        suspicion_factor = suspicion_factors[int(user_id)]
 
-            if suspicion_factor >= settings.SUSPICION_THRESHOLD:
-                add_rating_to_redis(article.pk, user_id, score, rating_type='suspicious',
-                                    suspicion_factor=suspicion_factor)
-            else:
-                add_rating_to_redis(article.pk, user_id, score, rating_type='normal', suspicion_factor=suspicion_factor)
+        if suspicion_factor >= settings.SUSPICION_THRESHOLD:
+            classified_ratings.append((user_id, rating_data, 'suspicious', suspicion_factor))
+        else:
+            classified_ratings.append((user_id, rating_data, 'normal', suspicion_factor))
 
-            delete_user_rating_from_redis(article.pk, user_id, rating_type='unprocessed')
+    return classified_ratings
 
 
-@shared_task
-def process_suspicious_ratings():
-    articles = Article.objects.all()
+def _classify_article_ratings(article):
+    logger.info(f"Processing unprocessed ratings for article {article.title} (ID: {article.pk})")
+
+    unprocessed_ratings = get_ratings_from_redis(article.pk, rating_type='unprocessed')
+    if not unprocessed_ratings:
+        return
+
+    move_classified_ratings_in_redis(article.pk, _classify_ratings(article, unprocessed_ratings))
 
-    for article in articles:
-        logger.info(f"Processing suspicious ratings for article {article.title} (ID: {article.pk})")
 
-        suspicious_ratings = get_ratings_from_redis(article.pk, rating_type='suspicious')
-        if not suspicious_ratings:
-            continue
+def _process_article_suspicious_ratings(article):
+    logger.info(f"Processing suspicious ratings for article {article.title} (ID: {article.pk})")
 
-        sorted_ratings = sorted(suspicious_ratings.items(), key=lambda x: x[1]['timestamp'])
+    suspicious_ratings = get_ratings_from_redis(article.pk, rating_type='suspicious')
+    if not suspicious_ratings:
+        return
 
-        total_ratings_count = len(sorted_ratings)
-        ratings_to_process_count = int(total_ratings_count * 0.2) if total_ratings_count > 5 else 1
+    sorted_ratings = sorted(suspicious_ratings.items(), key=lambda x: x[1]['timestamp'])
 
-        ratings_to_process = sorted_ratings[:ratings_to_process_count]
+    total_ratings_count = len(sorted_ratings)
+    ratings_to_process_count = int(total_ratings_count * 0.2) if total_ratings_count > 5 else 1
 
-        total_score_suspicious = 0
-        total_ratings_suspicious = 0
+    ratings_to_process = sorted_ratings[:ratings_to_process_count]
 
-        existing_ratings = Rating.objects.filter(article=article)
-        total_score_db = sum([rating.score for rating in existing_ratings])
-        total_ratings_db = article.ratings_count
+    _commit_ratings(article, ratings_to_process, 'suspicious')
 
-        for user_id, rating_data in ratings_to_process:
-            score = rating_data['score']
-            suspicion_factor = rating_data['suspicion_factor']
+    if ratings_to_process_count < total_ratings_count:
+        mark_articles_dirty([article.pk], 'suspicious')
 
-            rating_diff, is_new = Rating.update_or_create_rating(user_id, article, score, suspicion_factor)
+    logger.info(f"Processed {ratings_to_process_count} suspicious ratings for article {article.title}.")
 
-            if is_new:
-                total_ratings_suspicious += 1
 
-            total_score_suspicious += rating_diff
-            delete_user_rating_from_redis(article.pk, user_id, rating_type='suspicious')
+def _process_article_normal_ratings(article):
+    logger.info(f"Processing normal ratings for article {article.title} (ID: {article.pk})")
 
-        total_score = total_score_db + total_score_suspicious
-        total_ratings = total_ratings_db + total_ratings_suspicious
+    normal_ratings = get_ratings_from_redis(article.pk, rating_type='normal')
+    if not normal_ratings:
+        return
 
-        article.update_avg_rating(total_score, total_ratings)
+    sorted_ratings = sorted(normal_ratings.items(), key=lambda x: x[1]['timestamp'])
 
-        logger.info(f"Processed {ratings_to_process_count} suspicious ratings for article {article.title}.")
+    _commit_ratings(article, sorted_ratings, 'normal')
+
+    logger.info(f"Processed {len(sorted_ratings)} normal ratings for article {article.title}.")
+
+
+@shared_task
+def process_unprocessed_ratings():
+    if settings.RATING_INGEST_MODE == 'stream':
+        for _ in range(settings.RATING_STREAM_CONSUMERS):
+            consume_rating_stream.delay()
+
+    # Hash queues are drained in stream mode too so ratings queued before switching modes are not lost.
+    _dispatch_rating_shards('unprocessed')
+
+
+@shared_task
+def consume_rating_stream():
+    consumer = f"{socket.gethostname()}:{os.getpid()}"
+    ensure_rating_stream_group()
+
+    for _ in range(settings.RATING_STREAM_MAX_BATCHES):
+        entries = read_rating_stream(consumer, settings.RATING_STREAM_BATCH_SIZE)
+        if not entries:
+            break
+
+        ratings_by_article = {}
+        for _, rating_data in entries:
+            ratings_by_article.setdefault(rating_data['article'], {})[rating_data['user']] = rating_data
+
+        for article in Article.objects.filter(pk__in=ratings_by_article).defer('content'):
+            classified_ratings = _classify_ratings(article, ratings_by_article[article.pk])
+            add_classified_ratings_to_redis(article.pk, classified_ratings)
+
+        ack_rating_stream([entry_id for entry_id, _ in entries])
+        logger.info(f"Consumer {consumer} classified {len(entries)} ratings from the rating stream.")
+
+
+@shared_task
+def process_suspicious_ratings():
+    _dispatch_rating_shards('suspicious')
 
 
 @shared_task
 def process_normal_ratings():
-    articles = Article.objects.all()
+    _dispatch_rating_shards('normal')
 
-    for article in articles:
-        logger.info(f"Processing normal ratings for article {article.title} (ID: {article.pk})")
 
-        normal_ratings = get_ratings_from_redis(article.pk, rating_type='normal')
-        if not normal_ratings:
-            continue
+RATING_PROCESSORS = {
+    'unprocessed': _classify_article_ratings,
+    'suspicious': _process_article_suspicious_ratings,
+    'normal': _process_article_normal_ratings,
+}
 
-        sorted_ratings = sorted(normal_ratings.items(), key=lambda x: x[1]['timestamp'])
 
-        total_score_normal = 0
-        total_ratings_normal = 0
+# Suspicious ratings are deliberately applied a fraction per run, so only these queues are drained adaptively.
+ADAPTIVE_RATING_TYPES = ('unprocessed', 'normal')
 
-        existing_ratings = Rating.objects.filter(article=article)
-        total_score_db = sum([rating.score for rating in existing_ratings])
-        total_ratings_db = article.ratings_count
 
-        for user_id, rating_data in sorted_ratings:
-            score = rating_data['score']
-            suspicion_factor = rating_data['suspicion_factor']
+def _dispatch_rating_shards(rating_type):
+    # Idle shards are not dispatched at all, so an empty system costs one Redis round-trip per beat.
+    shards = [shard for shard, backlog in enumerate(count_dirty_articles(rating_type)) if backlog]
 
-            rating_diff, is_new = Rating.update_or_create_rating(user_id, article, score, suspicion_factor)
+    if settings.RATING_TASK_SHARDS > 1:
+        if shards:
+            group(process_rating_shard.s(rating_type, shard) for shard in shards).apply_async()
+    else:
+        for shard in shards:
+            process_rating_shard(rating_type, shard)
 
-            if is_new:
-                total_ratings_normal += 1
 
-            total_score_normal += rating_diff
-            delete_user_rating_from_redis(article.pk, user_id, rating_type='normal')
+@shared_task
+def process_rating_shard(rating_type, shard):
+    lock = get_rating_task_lock(rating_type, shard)
+    if not lock.acquire(blocking=False):
+        logger.info(f"Shard {shard} of {rating_type} ratings is already being processed, skipping.")
+        return
+
+    try:
+        _process_dirty_articles(rating_type, shard, RATING_PROCESSORS[rating_type],
+                                heartbeat=lambda: lock.extend(settings.RATING_TASK_LOCK_TIMEOUT, replace_ttl=True))
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            logger.warning(f"Lock of shard {shard} of {rating_type} ratings expired before processing finished.")
+
+    if settings.RATING_TASK_ADAPTIVE and rating_type in ADAPTIVE_RATING_TYPES:
+        backlog = count_dirty_articles(rating_type)[shard]
+        if backlog >= settings.RATING_TASK_BACKLOG_THRESHOLD:
+            logger.info(f"{backlog} articles are waiting in shard {shard} of {rating_type} ratings, re-triggering.")
+            process_rating_shard.apply_async((rating_type, shard))
 
-        total_score = total_score_db + total_score_normal
-        total_ratings = total_ratings_db + total_ratings_normal
 
-        article.update_avg_rating(total_score, total_ratings)
+@shared_task
+def create_future_rating_partitions():
+    if not settings.RATING_PARTITIONING_ENABLED:
+        return
 
-        logger.info(f"Processed {len(sorted_ratings)} normal ratings for article {article.title}.")
+    created = create_rating_partitions(settings.RATING_PARTITION_MONTHS_AHEAD)
+    if created:
+        logger.info(f"Created rating partitions {', '.join(created)}.")
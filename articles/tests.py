@@ -1,8 +1,48 @@
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import datetime
+import json
+import threading
+from decimal import Decimal
+
+import numpy as np
+from io import StringIO
+from unittest import mock
 from .models import Article, Rating
+from redis.cluster import key_slot
 from rest_framework_simplejwt.tokens import RefreshToken
+from utils.article_cache_utils import (build_articles_page, get_article_page_index_key, get_articles_page_cache_key,
+                                       update_article_in_cache)
+from utils.article_ids_utils import ARTICLE_IDS_KEY
+from utils import cache_utils
+from utils.cache_utils import get_or_set_cache, update_cache
+from utils.histogram_utils import get_histogram_key, get_score_distribution, get_spike_counts
+from utils.partition_utils import add_months, month_start, get_partition_name
+from utils import rate_limit_utils
+from utils import profile_utils
+from utils.profile_utils import (get_recent_user_scores, get_user_profile_key, get_user_profile_version_key,
+                                 record_user_ratings)
+from utils import redis_connection_utils
+from utils.redis_connection_utils import create_redis_client, parse_redis_nodes
+from utils.rate_limit_utils import get_article_bucket_key, get_user_bucket_key
+from utils.rating_utils import calculate_suspicion_batch
+from utils.score_distribution import ScoreDistribution
+from utils.redis_utils import (RATING_STREAM_GROUP, RATING_STREAM_KEY, RATING_STRUCT, RATING_STRUCT_V1,
+                               RATING_STRUCT_V2, RATING_TYPES, add_classified_ratings_to_redis, add_rating_to_redis,
+                               claim_dirty_articles, count_dirty_articles, decode_rating, encode_rating,
+                               enqueue_rating, get_article_shard, get_dirty_articles_key, get_pending_ratings_key,
+                               get_processing_articles_key, get_ratings_from_redis, get_ratings_key,
+                               get_rating_task_lock, move_classified_ratings_in_redis, redis_client)
+from .tasks import (RATING_PROCESSORS, consume_rating_stream, process_normal_ratings, process_rating_shard,
+                    process_unprocessed_ratings)
 
 
 class ArticleTests(APITestCase):
@@ -20,7 +60,28 @@ class ArticleTests(APITestCase):
     def test_article_list_view(self):
         response = self.client.get('/api/articles/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertTrue(len(response.data) > 0)
+        self.assertTrue(len(response.data['results']) > 0)
+
+    @override_settings(CACHE_ENABLED=False, ARTICLES_PAGE_SIZE=2)
+    def test_article_list_view_cursor_pagination(self):
+        for i in range(3):
+            Article.objects.create(title=f"Article {i}", content="Content")
+
+        titles = []
+        url = '/api/articles/'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(len(response.data['results']) <= 2)
+            titles.extend(item['title'] for item in response.data['results'])
+            url = response.data['next']
+
+        self.assertEqual(titles, ["Test Article", "Article 0", "Article 1", "Article 2"])
+
+    def test_article_list_view_invalid_cursor(self):
+        response = self.client.get('/api/articles/', {'cursor': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['detail'], "Cursor must be a valid integer.")
 
     def test_article_create_view(self):
         data = {'title': 'New Article', 'content': 'Content for the new article.'}
@@ -49,9 +110,104 @@ class RatingTests(APITestCase):
         self.token = response.data['access']
         self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.token)
 
-        self.article = Article.objects.create(title="Test Article", content="This is a test article.")
+        redis_client.delete(ARTICLE_IDS_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article = Article.objects.create(title="Test Article", content="This is a test article.")
         self.user = User.objects.get(username='testuser')
+        redis_client.delete(get_user_bucket_key(self.user.pk), get_article_bucket_key(self.article.pk))
+
+    def tearDown(self):
+        redis_client.delete(ARTICLE_IDS_KEY, get_ratings_key(self.article.pk, 'unprocessed'))
+
+    @override_settings(RATING_USER_BURST=2, RATING_USER_RATE=0.01)
+    def test_rating_create_view_rate_limited(self):
+        data = {'article': self.article.pk, 'score': "3"}
+        responses = [self.client.post('/api/articles/rate/', data, format='json') for _ in range(3)]
+
+        self.assertEqual([response.status_code for response in responses], [201, 201, 429])
+        self.assertGreaterEqual(int(responses[2]['Retry-After']), 1)
+
+    @override_settings(RATING_USER_BURST=2, RATING_USER_RATE=0.1)
+    def test_bulk_rating_larger_than_burst_pays_every_rating(self):
+        other_articles = [Article.objects.create(title=f"Other {i}", content="Content") for i in range(3)]
+        data = {'ratings': [{'article': article.pk, 'score': "3"} for article in [self.article, *other_articles]]}
+        bulk = self.client.post('/api/articles/rate/bulk/', data, format='json')
+        single = self.client.post('/api/articles/rate/', {'article': self.article.pk, 'score': "3"}, format='json')
+
+        self.assertEqual(bulk.status_code, status.HTTP_200_OK)
+        self.assertEqual(single.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreaterEqual(int(single['Retry-After']), 29)
+        redis_client.delete(*[get_ratings_key(article.pk, 'unprocessed') for article in other_articles])
+
+    @override_settings(RATING_MAX_BACKLOG=1, RATING_BACKLOG_RETRY_AFTER=30)
+    def test_rating_create_view_rejects_when_backlog_is_full(self):
+        redis_client.delete(get_pending_ratings_key())
+        data = {'article': self.article.pk, 'score': "3"}
+        with mock.patch.dict(rate_limit_utils._backlog_state, {'checked_at': float('-inf'), 'full': False}):
+            first = self.client.post('/api/articles/rate/', data, format='json')
+            rate_limit_utils._backlog_state['checked_at'] = float('-inf')
+            second = self.client.post('/api/articles/rate/', data, format='json')
+
+        redis_client.delete(get_pending_ratings_key())
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(second['Retry-After'], '30')
+
+    def test_rating_create_view_skips_article_query(self):
+        data = {'article': self.article.pk, 'score': "3"}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/articles/rate/', data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(any('"articles_article"' in query['sql'] for query in queries.captured_queries))
+
+    def test_rating_create_view_falls_back_to_database(self):
+        redis_client.delete(ARTICLE_IDS_KEY)
+        data = {'article': self.article.pk, 'score': "3"}
+        response = self.client.post('/api/articles/rate/', data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(redis_client.sismember(ARTICLE_IDS_KEY, self.article.pk))
+
+    def test_rating_create_view_deleted_article(self):
+        article_id = self.article.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article.delete()
+
+        data = {'article': article_id, 'score': "3"}
+        response = self.client.post('/api/articles/rate/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.article.pk = article_id
+
+    def test_rating_create_view_invalid_article_id(self):
+        data = {'article': "abc", 'score': "3"}
+        response = self.client.post('/api/articles/rate/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['detail'], "Article must be a valid integer.")
 
+    def test_bulk_rating_create_view(self):
+        other_article = Article.objects.create(title="Other Article", content="This is another article.")
+        data = {'ratings': [
+            {'article': self.article.pk, 'score': "2"},
+            {'article': other_article.pk, 'score': "4"},
+            {'article': 9999, 'score': "3"},
+            {'article': self.article.pk, 'score': "7"},
+            {'article': self.article.pk, 'score': "5"},
+        ]}
+        response = self.client.post('/api/articles/rate/bulk/', data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['accepted'], 2)
+        self.assertEqual([result['status'] for result in response.data['results']], [201, 201, 404, 400, 201])
+        self.assertEqual(get_ratings_from_redis(self.article.pk)[self.user.pk]['score'], 5)
+        self.assertEqual(get_ratings_from_redis(other_article.pk)[self.user.pk]['score'], 4)
+        redis_client.delete(get_ratings_key(other_article.pk, 'unprocessed'))
+
+    @override_settings(RATING_BULK_MAX_ITEMS=2)
+    def test_bulk_rating_create_view_too_many_items(self):
+        data = {'ratings': [{'article': self.article.pk, 'score': "3"}] * 3}
+        response = self.client.post('/api/articles/rate/bulk/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
     def test_rating_create_view_invalid_score(self):
         data = {'article': self.article.pk, 'score': "6"}
@@ -88,7 +244,745 @@ class ArticleRatingTests(APITestCase):
         rating = Rating.objects.create(user=self.user, article=self.article, score=3)
         response = self.client.get('/api/articles/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data[0]['user_rating'], rating.score)
+        self.assertEqual(response.data['results'][0]['user_rating'], rating.score)
+
+    @override_settings(CACHE_ENABLED=False)
+    def test_article_list_query_count_is_constant(self):
+        Rating.objects.create(user=self.user, article=self.article, score=4)
+        with CaptureQueriesContext(connection) as single_article:
+            self.client.get('/api/articles/')
+
+        for i in range(5):
+            article = Article.objects.create(title=f"Article {i}", content="Content")
+            Rating.objects.create(user=self.user, article=article, score=i)
+        with CaptureQueriesContext(connection) as many_articles:
+            response = self.client.get('/api/articles/')
+
+        self.assertEqual(len(single_article), len(many_articles))
+        self.assertEqual([item['user_rating'] for item in response.data['results']], [4, 0, 1, 2, 3, 4])
+
+    @override_settings(CACHE_ENABLED=True, ARTICLES_PAGE_SIZE=50)
+    def test_cached_article_list_skips_article_table(self):
+        cache.delete(get_articles_page_cache_key(0, 50))
+        Rating.objects.create(user=self.user, article=self.article, score=2)
+        self.client.get('/api/articles/')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/articles/')
+
+        self.assertFalse(any('"articles_article"' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(response.data['results'][0]['id'], self.article.pk)
+        self.assertEqual(response.data['results'][0]['user_rating'], 2)
+
+
+# Authentication and page reads run in other threads with their own database connections, which only see committed
+# rows.
+@override_settings(CACHE_ENABLED=False)
+class AsyncViewTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.headers = {'authorization': f"Bearer {RefreshToken.for_user(self.user).access_token}"}
+
+        redis_client.delete(ARTICLE_IDS_KEY)
+        self.article = Article.objects.create(title="Test Article", content="This is a test article.")
+        Rating.objects.create(user=self.user, article=self.article, score=2)
+        redis_client.delete(get_user_bucket_key(self.user.pk), get_article_bucket_key(self.article.pk))
+
+    def tearDown(self):
+        redis_client.delete(ARTICLE_IDS_KEY, get_ratings_key(self.article.pk, 'unprocessed'))
+
+    async def test_async_article_list(self):
+        response = await self.async_client.get('/api/articles/async/', headers=self.headers)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'], [{"id": self.article.pk, "title": "Test Article",
+                                                       "ratings_count": 0, "avg_rating": 0.0, "user_rating": 2}])
+
+    async def test_async_rating_create(self):
+        response = await self.async_client.post('/api/articles/async/rate/',
+                                                {'article': self.article.pk, 'score': "4"},
+                                                content_type='application/json', headers=self.headers)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(get_ratings_from_redis(self.article.pk)[self.user.pk]['score'], 4)
+
+    async def test_async_rating_create_invalid_article(self):
+        response = await self.async_client.post('/api/articles/async/rate/', {'article': 9999, 'score': "4"},
+                                                content_type='application/json', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_async_views_require_authentication(self):
+        response = await self.async_client.get('/api/articles/async/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        response = await self.async_client.get('/api/articles/async/', headers={'authorization': "Bearer invalid"})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(CACHE_ENABLED=True, ARTICLES_PAGE_SIZE=2)
+class ArticleListCacheTests(APITestCase):
+
+    def setUp(self):
+        self.client.post('/api/auth/register/', {'username': 'testuser', 'password': 'testpassword'}, format='json')
+        response = self.client.post('/api/auth/login/', {'username': 'testuser', 'password': 'testpassword'},
+                                    format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+
+        cache.delete_many([get_articles_page_cache_key(0, 2), get_articles_page_cache_key(-1, 2)])
+        self.article = Article.objects.create(title="Test Article", content="This is a test article.")
+        self.client.get('/api/articles/')
+
+    def tearDown(self):
+        redis_client.delete(get_article_page_index_key(self.article.pk))
+
+    def test_aggregate_update_patches_cached_page(self):
+        self.article.update_avg_rating(7, 2)
+        update_article_in_cache(self.article)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/articles/')
+
+        self.assertFalse(any('"articles_article"' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(response.data['results'][0]['ratings_count'], 2)
+        self.assertEqual(response.data['results'][0]['avg_rating'], 3.5)
+
+    def test_aggregate_update_patches_every_cached_page(self):
+        other_page_key = get_articles_page_cache_key(-1, 2)
+        get_or_set_cache(other_page_key, lambda: build_articles_page(-1, 2))
+        self.article.update_avg_rating(5, 1)
+        update_article_in_cache(self.article)
+
+        response = self.client.get('/api/articles/')
+        self.assertEqual(response.data['results'][0]['ratings_count'], 1)
+        self.assertEqual(json.loads(cache.get(other_page_key)[0])[0][2], 1)
+
+    def test_created_article_is_appended_to_cached_page(self):
+        self.client.post('/api/articles/create/', {'title': 'First', 'content': 'Content'}, format='json')
+        self.client.post('/api/articles/create/', {'title': 'Second', 'content': 'Content'}, format='json')
+
+        response = self.client.get('/api/articles/')
+        self.assertEqual([item['title'] for item in response.data['results']], ["Test Article", "First"])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([item['title'] for item in response.data['results']], ["Second"])
+
+    def test_only_next_link_cursors_are_cached(self):
+        second = Article.objects.create(title="Second", content="Content")
+        Article.objects.create(title="Third", content="Content")
+        cache.delete(get_articles_page_cache_key(0, 2))
+        response = self.client.get('/api/articles/')
+        self.client.get(response.data['next'])
+        self.client.get(f'/api/articles/?cursor={self.article.pk}')
+
+        self.assertIsNotNone(cache.get(get_articles_page_cache_key(second.pk, 2)))
+        self.assertIsNone(cache.get(get_articles_page_cache_key(self.article.pk, 2)))
+        cache.delete(get_articles_page_cache_key(second.pk, 2))
+
+
+class ArticleAggregateTests(TestCase):
+
+    def setUp(self):
+        self.article = Article.objects.create(title="Test Article", content="This is a test article.")
+        self.users = [User.objects.create_user(username=f'user{i}', password='password') for i in range(3)]
+
+    def test_apply_rating_delta(self):
+        self.article.apply_rating_delta(9, 2)
+        self.article.apply_rating_delta(-2, 0)
+
+        article = Article.objects.get(pk=self.article.pk)
+        self.assertEqual(article.total_score, 7)
+        self.assertEqual(article.ratings_count, 2)
+        self.assertEqual(article.avg_rating, Decimal('3.50'))
+        self.assertEqual(self.article.avg_rating, Decimal('3.50'))
+
+    def test_bulk_upsert_ratings(self):
+        other_article = Article.objects.create(title="Other", content="Other article.")
+        Rating.objects.create(user=self.users[0], article=self.article, score=1)
+
+        deltas = Rating.bulk_upsert_ratings([
+            (self.users[0].pk, self.article.pk, 4, 0.1),
+            (self.users[1].pk, self.article.pk, 2, 0.0),
+            (self.users[1].pk, other_article.pk, 3, 0.0),
+            (self.users[1].pk, other_article.pk, 5, 0.2),
+        ])
+
+        self.assertEqual(deltas, {self.article.pk: (5, 1), other_article.pk: (5, 1)})
+        self.assertEqual(Rating.objects.count(), 3)
+        rating = Rating.objects.get(user=self.users[0], article=self.article)
+        self.assertEqual((rating.score, rating.suspicion_factor), (4, 0.1))
+        self.assertEqual(Rating.objects.get(user=self.users[1], article=other_article).score, 5)
+
+    @override_settings(RATING_PARTITIONING_ENABLED=True)
+    def test_bulk_upsert_ratings_on_partitioned_table(self):
+        self.test_bulk_upsert_ratings()
+
+    def test_partition_names_follow_months(self):
+        now = datetime.datetime(2026, 11, 18, tzinfo=datetime.timezone.utc)
+        months = [add_months(month_start(now), offset) for offset in range(3)]
+        self.assertEqual([get_partition_name(month) for month in months],
+                         ['articles_rating_p2026_11', 'articles_rating_p2026_12', 'articles_rating_p2027_01'])
+
+    def test_rebuild_article_aggregates_command(self):
+        for user, score in zip(self.users, [5, 4, 0]):
+            Rating.objects.create(user=user, article=self.article, score=score)
+        empty_article = Article.objects.create(title="Empty", content="No ratings", ratings_count=4, total_score=9)
+
+        call_command('rebuild_article_aggregates', '--batch-size', '1', stdout=StringIO())
+
+        self.article.refresh_from_db()
+        empty_article.refresh_from_db()
+        self.assertEqual((self.article.total_score, self.article.ratings_count), (9, 3))
+        self.assertEqual(self.article.avg_rating, Decimal('3.00'))
+        self.assertEqual((empty_article.total_score, empty_article.ratings_count), (0, 0))
+        self.assertEqual(empty_article.avg_rating, Decimal('0.00'))
+
+
+class RatingTaskTests(TestCase):
+
+    def setUp(self):
+        self.article = Article.objects.create(title="Test Article", content="This is a test article.")
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.clear_queues()
+
+    def tearDown(self):
+        self.clear_queues()
+
+    def clear_queues(self):
+        redis_client.delete(RATING_STREAM_KEY, get_pending_ratings_key())
+        for rating_type, prefix in RATING_TYPES.items():
+            redis_client.delete(get_dirty_articles_key(rating_type, 0), get_processing_articles_key(rating_type, 0),
+                                f"{prefix}:{self.article.pk}")
+
+    def test_idle_task_does_not_scan_articles(self):
+        with CaptureQueriesContext(connection) as queries:
+            process_normal_ratings()
+        self.assertFalse(any('"articles_article"' in query['sql'] for query in queries.captured_queries))
+
+    def test_normal_ratings_are_committed(self):
+        add_rating_to_redis(self.article.pk, self.user.pk, 4, rating_type='normal', suspicion_factor=0.1)
+        process_normal_ratings()
+
+        self.article.refresh_from_db()
+        self.assertEqual((self.article.ratings_count, self.article.total_score), (1, 4))
+        self.assertEqual(Rating.objects.get(user=self.user, article=self.article).score, 4)
+        self.assertFalse(redis_client.exists(f"normal_ratings:{self.article.pk}"))
+        self.assertFalse(redis_client.sismember(get_dirty_articles_key('normal', 0), self.article.pk))
+        self.assertFalse(redis_client.exists(get_processing_articles_key('normal', 0)))
+
+    def test_articles_of_a_killed_worker_are_claimed_again(self):
+        add_rating_to_redis(self.article.pk, self.user.pk, 4, rating_type='normal')
+        self.assertEqual(claim_dirty_articles('normal', 0), [self.article.pk])
+
+        # The worker is killed before committing: the next run picks the article up again.
+        self.assertEqual(count_dirty_articles('normal'), [1])
+        process_normal_ratings()
+
+        self.assertEqual(Rating.objects.get(user=self.user, article=self.article).score, 4)
+        self.assertEqual(count_dirty_articles('normal'), [0])
+    @override_settings(RATING_TASK_SHARDS=4)
+    def test_locked_shard_is_skipped(self):
+        shard = get_article_shard(self.article.pk)
+        add_rating_to_redis(self.article.pk, self.user.pk, 4, rating_type='normal')
+        lock = get_rating_task_lock('normal', shard)
+        self.assertTrue(lock.acquire(blocking=False))
+
+        try:
+            process_rating_shard('normal', shard)
+            self.assertEqual(Rating.objects.count(), 0)
+        finally:
+            lock.release()
+
+        process_rating_shard('normal', (shard + 1) % 4)
+        self.assertEqual(Rating.objects.count(), 0)
+
+        process_rating_shard('normal', shard)
+        self.assertEqual(Rating.objects.get(user=self.user, article=self.article).score, 4)
+        redis_client.delete(get_dirty_articles_key('normal', shard))
+
+    @override_settings(RATING_TASK_ADAPTIVE=True, RATING_TASK_BACKLOG_THRESHOLD=1)
+    def test_shard_is_retriggered_when_backlog_grows(self):
+        other_article = Article.objects.create(title="Other", content="Other article.")
+        add_rating_to_redis(self.article.pk, self.user.pk, 4, rating_type='normal')
+
+        def process_article(article):
+            add_rating_to_redis(other_article.pk, self.user.pk, 2, rating_type='normal')
+
+        with mock.patch.dict(RATING_PROCESSORS, {'normal': process_article}), \
+                mock.patch.object(process_rating_shard, 'apply_async') as apply_async:
+            process_rating_shard('normal', 0)
+            apply_async.assert_called_once_with(('normal', 0))
+
+            redis_client.delete(get_dirty_articles_key('normal', 0))
+            add_rating_to_redis(self.article.pk, self.user.pk, 4, rating_type='normal')
+            apply_async.reset_mock()
+            with self.settings(RATING_TASK_BACKLOG_THRESHOLD=2):
+                process_rating_shard('normal', 0)
+            apply_async.assert_not_called()
+
+        redis_client.delete(f"normal_ratings:{other_article.pk}")
+
+    def test_rating_encoding_round_trip(self):
+        raw = encode_rating(4, 0.125, 1700000000)
+        self.assertEqual(len(raw), RATING_STRUCT.size)
+        self.assertEqual(decode_rating(raw), {'score': 4, 'suspicion_factor': 0.125, 'timestamp': 1700000000,
+                                              'raw': raw})
+
+    def test_rating_encoding_is_smaller_than_legacy_string(self):
+        self.assertLess(len(encode_rating(3, 0.0, 1760000000)), len(b"3,0.0,1760000000"))
+        raw = encode_rating(3, 0.3, 1760000000.123)
+        self.assertEqual(decode_rating(raw)['suspicion_factor'], 0.3)
+        self.assertAlmostEqual(decode_rating(raw)['timestamp'], 1760000000.123)
+
+    def test_version_2_ratings_are_read(self):
+        raw = RATING_STRUCT_V2.pack(2, 4, 0.125, 1700000001500)
+        self.assertEqual(decode_rating(raw)['timestamp'], 1700000001.5)
+        redis_client.hset(get_ratings_key(self.article.pk, 'normal'), self.user.pk, raw)
+
+        older = {'score': 1, 'timestamp': 1700000001.25}
+        self.assertEqual(add_classified_ratings_to_redis(self.article.pk, [(self.user.pk, older, 'normal', 0.0)]), 0)
+        self.assertEqual(get_ratings_from_redis(self.article.pk, 'normal')[self.user.pk]['score'], 4)
+
+    def test_older_classified_rating_does_not_overwrite_newer(self):
+        newer = {'score': 5, 'timestamp': 1700000000.5}
+        older = {'score': 1, 'timestamp': 1700000000.25}
+        add_classified_ratings_to_redis(self.article.pk, [(self.user.pk, newer, 'normal', 0.0)])
+        written = add_classified_ratings_to_redis(self.article.pk, [(self.user.pk, older, 'suspicious', 0.9)])
+
+        self.assertEqual(written, 0)
+        self.assertEqual(get_ratings_from_redis(self.article.pk, 'normal')[self.user.pk]['score'], 5)
+        self.assertEqual(get_ratings_from_redis(self.article.pk, 'suspicious'), {})
+
+        add_classified_ratings_to_redis(self.article.pk, [(self.user.pk, {'score': 2, 'timestamp': 1700000001},
+                                                           'suspicious', 0.9)])
+        self.assertEqual(get_ratings_from_redis(self.article.pk, 'suspicious')[self.user.pk]['score'], 2)
+        self.assertEqual(get_ratings_from_redis(self.article.pk, 'normal'), {})
+
+    def test_version_1_ratings_are_compared_in_seconds(self):
+        raw = RATING_STRUCT_V1.pack(1, 4, 0.0, 1700000001)
+        redis_client.hset(get_ratings_key(self.article.pk, 'normal'), self.user.pk, raw)
+        self.assertEqual(decode_rating(raw)['timestamp'], 1700000001)
+
+        older = {'score': 1, 'timestamp': 1700000000.9}
+        self.assertEqual(add_classified_ratings_to_redis(self.article.pk, [(self.user.pk, older, 'normal', 0.0)]), 0)
+        self.assertEqual(get_ratings_from_redis(self.article.pk, 'normal')[self.user.pk]['score'], 4)
+
+    def test_legacy_queued_ratings_are_migrated(self):
+        redis_client.hset(f"unprocessed_ratings:{self.article.pk}", self.user.pk, "3,0.0,1700000000")
+
+        ratings = get_ratings_from_redis(self.article.pk)
+        self.assertEqual(ratings[self.user.pk]['score'], 3)
+
+        move_classified_ratings_in_redis(self.article.pk, [(self.user.pk, ratings[self.user.pk], 'normal', 0.25)])
+        raw = redis_client.hget(f"normal_ratings:{self.article.pk}", self.user.pk)
+        self.assertEqual(decode_rating(raw), {'score': 3, 'suspicion_factor': 0.25, 'timestamp': 1700000000,
+                                              'raw': raw})
+
+    def test_rating_resubmitted_during_classification_is_kept(self):
+        other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        add_rating_to_redis(self.article.pk, self.user.pk, 1)
+        add_rating_to_redis(self.article.pk, other_user.pk, 2)
+        ratings = get_ratings_from_redis(self.article.pk)
+        add_rating_to_redis(self.article.pk, self.user.pk, 5)
+
+        moved = move_classified_ratings_in_redis(
+            self.article.pk, [(user_id, data, 'normal', 0.0) for user_id, data in ratings.items()]
+        )
+
+        self.assertEqual(moved, 1)
+        self.assertEqual([data['score'] for data in get_ratings_from_redis(self.article.pk).values()], [5])
+        self.assertEqual([data['score'] for data in get_ratings_from_redis(self.article.pk, 'normal').values()], [2])
+        self.assertTrue(redis_client.sismember(get_dirty_articles_key('normal', 0), self.article.pk))
+
+
+    def test_pending_ratings_are_counted(self):
+        other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        enqueue_rating(self.article.pk, self.user.pk, 1)
+        enqueue_rating(self.article.pk, self.user.pk, 2)
+        enqueue_rating(self.article.pk, other_user.pk, 3)
+        self.assertEqual(int(redis_client.get(get_pending_ratings_key())), 2)
+
+        ratings = get_ratings_from_redis(self.article.pk)
+        move_classified_ratings_in_redis(self.article.pk, [(user_id, data, 'normal', 0.0)
+                                                           for user_id, data in ratings.items()])
+        self.assertEqual(int(redis_client.get(get_pending_ratings_key())), 2)
+
+        process_normal_ratings()
+        self.assertEqual(int(redis_client.get(get_pending_ratings_key())), 0)
+
+        redis_client.hset(get_ratings_key(self.article.pk), self.user.pk, encode_rating(4, 0.0, 1700000000))
+        call_command('mark_pending_ratings', stdout=StringIO())
+        self.assertEqual(int(redis_client.get(get_pending_ratings_key())), 1)
+
+    def test_ratings_of_deleted_articles_are_dropped(self):
+        other_article = Article.objects.create(title="Other", content="Other article.")
+        article_id = other_article.pk
+        enqueue_rating(article_id, self.user.pk, 4)
+        add_rating_to_redis(article_id, self.user.pk, 2, rating_type='normal')
+        other_article.delete()
+
+        process_unprocessed_ratings()
+
+        self.assertEqual(int(redis_client.get(get_pending_ratings_key())), 0)
+        self.assertEqual(redis_client.exists(*[get_ratings_key(article_id, rating_type)
+                                               for rating_type in RATING_TYPES]), 0)
+        self.assertEqual(count_dirty_articles('unprocessed'), [0])
+        redis_client.delete(get_dirty_articles_key('normal', 0))
+
+    def test_cluster_queues_follow_shard_count_changes(self):
+        with self.settings(REDIS_MODE='cluster', RATING_TASK_SHARDS=1):
+            enqueue_rating(self.article.pk, self.user.pk, 4)
+            add_rating_to_redis(self.article.pk, self.user.pk, 2, rating_type='normal')
+            old_keys = [get_ratings_key(self.article.pk, rating_type) for rating_type in RATING_TYPES]
+            old_keys += [get_dirty_articles_key(rating_type, 0) for rating_type in RATING_TYPES]
+            old_keys.append(get_pending_ratings_key(0))
+
+        with self.settings(REDIS_MODE='cluster', RATING_TASK_SHARDS=self.article.pk + 1):
+            call_command('mark_pending_ratings', stdout=StringIO())
+            shard = get_article_shard(self.article.pk)
+            new_keys = [get_ratings_key(self.article.pk, rating_type) for rating_type in RATING_TYPES]
+            new_keys += [get_dirty_articles_key(rating_type, shard) for rating_type in RATING_TYPES]
+            new_keys.append(get_pending_ratings_key(shard))
+
+            self.assertEqual(get_ratings_from_redis(self.article.pk)[self.user.pk]['score'], 4)
+            self.assertEqual(get_ratings_from_redis(self.article.pk, 'normal')[self.user.pk]['score'], 2)
+            self.assertEqual(redis_client.exists(*old_keys[:3]), 0)
+            self.assertEqual(int(redis_client.get(get_pending_ratings_key(shard))), 2)
+            self.assertEqual(int(redis_client.get(get_pending_ratings_key(0))), 0)
+
+        redis_client.delete(*old_keys, *new_keys)
+
+    @override_settings(RATING_INGEST_MODE='stream')
+    def test_stream_ratings_are_classified(self):
+        enqueue_rating(self.article.pk, self.user.pk, 1)
+        enqueue_rating(self.article.pk, self.user.pk, 3)
+        enqueue_rating(9999, self.user.pk, 3)
+
+        consume_rating_stream()
+
+        queued = {**get_ratings_from_redis(self.article.pk, 'normal'),
+                  **get_ratings_from_redis(self.article.pk, 'suspicious')}
+        self.assertEqual([data['score'] for data in queued.values()], [3])
+        self.assertEqual(redis_client.xpending(RATING_STREAM_KEY, RATING_STREAM_GROUP)['pending'], 0)
+        self.assertEqual(redis_client.xlen(RATING_STREAM_KEY), 0)
+
+
+@override_settings(RATING_HISTOGRAM_ENABLED=False)
+class RatingIndexTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.article = Article.objects.create(title="Test Article", content="This is a test article.")
+        Rating.objects.create(user=self.user, article=self.article, score=3)
+
+    def explain(self, queryset):
+        if connection.vendor == 'postgresql':
+            # The test table is tiny, so the planner would always prefer a sequential scan.
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        return queryset.explain()
+
+    def test_article_window_queries_use_index(self):
+        since = timezone.now() - datetime.timedelta(days=7)
+        plans = [
+            self.explain(Rating.objects.filter(article=self.article, created_at__gte=since).values_list('score')),
+            self.explain(Rating.objects.filter(article=self.article, created_at__gte=since).values('article').annotate(
+                count=Count('id'))),
+        ]
+
+        for plan in plans:
+            self.assertIn('rating_article_created_idx', plan)
+
+    def test_recent_user_ratings_query_uses_index(self):
+        plan = self.explain(Rating.objects.filter(user=self.user).order_by('-created_at').values_list(
+            'article_id', 'score')[:10])
+        self.assertIn('rating_user_created_idx', plan)
+
+
+def reference_suspicion(score, user, article):
+    # The original one rating at a time calculation, which calculate_suspicion_batch must match.
+    suspicion_factor = 0.0
+    now = timezone.now()
+    one_hour_ago_yesterday = now - datetime.timedelta(days=1, hours=1)
+    one_hour_end_yesterday = now - datetime.timedelta(days=1)
+
+    today_ratings_count = Rating.objects.filter(
+        article=article, created_at__gte=one_hour_ago_yesterday
+    ).count()
+
+    past_ratings_count = Rating.objects.filter(
+        article=article, created_at__gte=one_hour_ago_yesterday, created_at__lt=one_hour_end_yesterday
+    ).count()
+
+    if past_ratings_count > 0:
+        ratings_diff = today_ratings_count - past_ratings_count
+        percentage_diff = abs(ratings_diff / past_ratings_count) * 100
+
+        if percentage_diff > 100:
+            suspicion_factor += min(np.log(percentage_diff / 100) / 5, 0.5)
+
+    user_recent_ratings = Rating.objects.filter(
+        user=user
+    ).order_by('-created_at')[:10]
+
+    zero_five_count = sum([1 for rating in user_recent_ratings if rating.score == 0 or rating.score == 5])
+    if zero_five_count > 0:
+        suspicion_factor += min(zero_five_count * 0.05, 0.3)
+
+    recent_ratings = Rating.objects.filter(
+        article=article,
+        created_at__gte=timezone.now() - datetime.timedelta(days=7)
+    ).values('score')
+
+    if len(recent_ratings) > 2:
+        scores = [rating['score'] for rating in recent_ratings]
+        mean_score = np.mean(scores)
+        std_dev = np.std(scores)
+
+        if abs(score - mean_score) > std_dev:
+            suspicion_factor += min((abs(score - mean_score) / std_dev) * 0.1, 0.5)
+
+    return min(suspicion_factor, 1.0)
+
+
+class SuspicionTests(TestCase):
+
+    def setUp(self):
+        self.article = Article.objects.create(title="Test Article", content="This is a test article.")
+        self.other_articles = [Article.objects.create(title=f"Other {i}", content="Other") for i in range(12)]
+        self.users = [User.objects.create_user(username=f'user{i}', password='password') for i in range(12)]
+        now = timezone.now()
+
+        for i, user in enumerate(self.users[:8]):
+            rating = Rating.objects.create(user=user, article=self.article, score=[1, 2, 2, 3, 5, 2, 1, 3][i])
+            created_at = now - datetime.timedelta(hours=24, minutes=30) if i < 2 else now - datetime.timedelta(hours=1)
+            Rating.objects.filter(pk=rating.pk).update(created_at=created_at)
+
+        for i, user in enumerate(self.users[8:]):
+            for j, other_article in enumerate(self.other_articles[:4 + 2 * i]):
+                Rating.objects.create(user=user, article=other_article, score=[0, 5, 3, 5][(i + j) % 4])
+
+        redis_client.delete(*[key for user in self.users
+                              for key in (get_user_profile_key(user.pk), get_user_profile_version_key(user.pk))])
+
+    def tearDown(self):
+        redis_client.delete(*[key for user in self.users
+                              for key in (get_user_profile_key(user.pk), get_user_profile_version_key(user.pk))])
+
+    def test_batch_matches_single_rating_calculation(self):
+        ratings = {user.pk: score for user, score in zip(self.users[8:], [0, 5, 2, 4])}
+
+        batch = calculate_suspicion_batch(self.article, ratings)
+
+        for user in self.users[8:]:
+            self.assertEqual(batch[user.pk], reference_suspicion(ratings[user.pk], user, self.article))
+
+    def test_batch_with_uniform_recent_scores(self):
+        Rating.objects.filter(article=self.article).update(score=3)
+        ratings = {self.users[8].pk: 3, self.users[9].pk: 0}
+
+        batch = calculate_suspicion_batch(self.article, ratings)
+
+        for user in self.users[8:10]:
+            self.assertEqual(batch[user.pk], reference_suspicion(ratings[user.pk], user, self.article))
+
+
+    @override_settings(USER_PROFILE_CACHE_ENABLED=True)
+    def test_user_profiles_follow_committed_ratings(self):
+        user = self.users[11]
+        calculate_suspicion_batch(self.article, {user.pk: 3})
+        self.assertTrue(redis_client.exists(get_user_profile_key(user.pk)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Rating.bulk_upsert_ratings([(user.pk, self.other_articles[10].pk, 0, 0.0),
+                                        (user.pk, self.other_articles[0].pk, 3, 0.0),
+                                        (user.pk, self.other_articles[9].pk, 3, 0.0)])
+
+        with CaptureQueriesContext(connection) as queries:
+            batch = calculate_suspicion_batch(self.article, {user.pk: 3})
+
+        self.assertFalse(any('"user_id" IN' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(batch[user.pk], reference_suspicion(3, user, self.article))
+
+    def test_profile_loaded_before_a_commit_is_not_cached(self):
+        user = self.users[0]
+
+        def load_recent_ratings(user_ids):
+            # A rating of the user is committed while the profile is being loaded.
+            record_user_ratings([(user.pk, self.other_articles[0].pk, 5, True)])
+            return {user.pk: [(self.article.pk, 1)]}
+
+        self.assertEqual(get_recent_user_scores([user.pk], load_recent_ratings), {user.pk: [1]})
+        self.assertFalse(redis_client.exists(get_user_profile_key(user.pk)))
+
+        get_recent_user_scores([user.pk], lambda user_ids: {user.pk: [(self.other_articles[0].pk, 5)]})
+        self.assertEqual(redis_client.get(get_user_profile_key(user.pk)), f"{self.other_articles[0].pk}:5".encode())
+
+    @override_settings(REDIS_MODE='cluster')
+    def test_user_profile_script_is_not_pipelined_in_cluster_mode(self):
+        with mock.patch.object(profile_utils, 'UPDATE_PROFILE_SCRIPT') as script:
+            record_user_ratings([(self.users[0].pk, self.article.pk, 3, True),
+                                 (self.users[1].pk, self.article.pk, 2, True)])
+
+        self.assertEqual(script.call_count, 2)
+        self.assertTrue(all(call.kwargs['client'] is None for call in script.call_args_list))
+
+    def test_rebuilt_histogram_matches_rating_table(self):
+        call_command('rebuild_rating_histograms', stdout=StringIO())
+
+        scores = list(Rating.objects.filter(article=self.article).values_list('score', flat=True))
+        distribution = get_score_distribution(self.article.pk)
+        self.assertEqual(distribution.count, len(scores))
+        self.assertAlmostEqual(distribution.mean, np.mean(scores))
+        self.assertAlmostEqual(distribution.std, np.std(scores))
+
+        today, past = get_spike_counts(self.article.pk)
+        self.assertEqual(today, 8)
+        self.assertIn(past, (0, 2))
+
+    def test_committed_ratings_update_histogram(self):
+        redis_client.delete(get_histogram_key(self.article.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            Rating.bulk_upsert_ratings([(self.users[8].pk, self.article.pk, 4, 0.0),
+                                        (self.users[9].pk, self.article.pk, 2, 0.0)])
+        with self.captureOnCommitCallbacks(execute=True):
+            Rating.bulk_upsert_ratings([(self.users[9].pk, self.article.pk, 0, 0.0)])
+
+        distribution = get_score_distribution(self.article.pk)
+        self.assertEqual(distribution.counts, [1, 0, 0, 0, 1, 0])
+        self.assertEqual((distribution.count, distribution.mean, distribution.std), (2, 2.0, 2.0))
+        self.assertEqual(get_spike_counts(self.article.pk), (2, 0))
+
+    def test_negative_histogram_counters_are_ignored(self):
+        key = get_histogram_key(self.article.pk)
+        hour = int(timezone.now().timestamp() // 3600)
+        redis_client.delete(key)
+        redis_client.hset(key, mapping={f"{hour}:0": -1, f"{hour}:5": 2})
+
+        distribution = get_score_distribution(self.article.pk)
+        redis_client.delete(key)
+        self.assertEqual(distribution.counts, [0, 0, 0, 0, 0, 2])
+        self.assertEqual(distribution.std, 0.0)
+
+
+class ScoreDistributionTests(SimpleTestCase):
+
+    def test_matches_numpy(self):
+        scores = [0, 5, 3, 3, 4, 1, 5]
+        distribution = ScoreDistribution()
+        for score in scores:
+            distribution.add(score)
+
+        self.assertEqual(distribution.count, len(scores))
+        self.assertAlmostEqual(distribution.mean, np.mean(scores))
+        self.assertAlmostEqual(distribution.std, np.std(scores))
+
+    def test_merge_and_empty(self):
+        self.assertEqual((ScoreDistribution().count, ScoreDistribution().mean, ScoreDistribution().std), (0, 0.0, 0.0))
+
+        merged = ScoreDistribution([1, 0, 0, 0, 0, 0]).merge(ScoreDistribution([0, 0, 0, 0, 0, 1]))
+        self.assertEqual(merged.counts, [1, 0, 0, 0, 0, 1])
+        self.assertEqual((merged.mean, merged.std), (2.5, 2.5))
+
+    def test_negative_counts(self):
+        self.assertEqual(ScoreDistribution([-1, 0, 0, 0, 0, 2]).std, 0.0)
+        self.assertEqual(ScoreDistribution([-1, 0, 0, 0, 0, 0]).mean, 0.0)
+
+
+@override_settings(CACHE_ENABLED=True)
+class CacheUtilsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.key = 'tests:cache_utils'
+        cache.delete_many([self.key, f'{self.key}:lock', f'{self.key}:dirty'])
+        self.calls = 0
+
+    def tearDown(self):
+        cache.delete_many([self.key, f'{self.key}:lock', f'{self.key}:dirty'])
+
+    def loader(self):
+        self.calls += 1
+        return []
+
+    def test_falsy_value_is_cached(self):
+        self.assertEqual(get_or_set_cache(self.key, self.loader, timeout=60), [])
+        self.assertEqual(get_or_set_cache(self.key, self.loader, timeout=60), [])
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_value_served_while_refresh_locked(self):
+        get_or_set_cache(self.key, self.loader, timeout=60)
+        value, _, delta = cache.get(self.key)
+        cache.set(self.key, (value, 0, delta), timeout=60)
+        cache.add(f'{self.key}:lock', 1, timeout=60)
+
+        self.assertEqual(get_or_set_cache(self.key, self.loader, timeout=60), [])
+        self.assertEqual(self.calls, 1)
+
+    def test_expired_value_is_refreshed(self):
+        get_or_set_cache(self.key, self.loader, timeout=60)
+        value, _, delta = cache.get(self.key)
+        cache.set(self.key, (value, 0, delta), timeout=60)
+
+        get_or_set_cache(self.key, self.loader, timeout=60)
+        self.assertEqual(self.calls, 2)
+        self.assertIsNone(cache.get(f'{self.key}:lock'))
+
+    @override_settings(CACHE_LOCK_WAIT=2)
+    def test_update_waits_for_lock(self):
+        get_or_set_cache(self.key, self.loader, timeout=60)
+        cache.add(f'{self.key}:lock', 1, timeout=60)
+        threading.Timer(0.1, cache.delete, args=[f'{self.key}:lock']).start()
+
+        update_cache(self.key, lambda value: value + [1])
+        self.assertEqual(get_or_set_cache(self.key, self.loader, timeout=60), [1])
+
+    @override_settings(CACHE_LOCK_WAIT=0.1)
+    def test_lock_holder_drops_value_after_update_timed_out(self):
+        get_or_set_cache(self.key, self.loader, timeout=60)
+        entry = cache.get(self.key)
+        cache.add(f'{self.key}:lock', 1, timeout=60)
+
+        update_cache(self.key, lambda value: value + [1])
+        cache_utils._store(self.key, entry, 60)
+
+        self.assertIsNone(cache.get(self.key))
+        self.assertIsNone(cache.get(f'{self.key}:dirty'))
+
+
+class RedisConnectionTests(SimpleTestCase):
+
+    def test_parse_redis_nodes(self):
+        self.assertEqual(parse_redis_nodes("redis-1:7000, redis-2:7001,"), [('redis-1', 7000), ('redis-2', 7001)])
+
+    @override_settings(REDIS_MODE='cluster', RATING_TASK_SHARDS=4)
+    def test_cluster_keys_of_a_shard_share_a_slot(self):
+        keys = [get_ratings_key(7, rating_type) for rating_type in RATING_TYPES]
+        keys += [get_dirty_articles_key(rating_type, get_article_shard(7)) for rating_type in ('normal', 'suspicious')]
+
+        self.assertEqual(keys[0], "unprocessed_ratings:{3}:7")
+        self.assertEqual(len({key_slot(key.encode()) for key in keys}), 1)
+
+    def test_standalone_keys_are_untagged(self):
+        self.assertEqual(get_ratings_key(7, 'normal'), "normal_ratings:7")
+        self.assertEqual(get_dirty_articles_key('normal', 0), "dirty_normal_ratings:0")
+
+    @override_settings(REDIS_MODE='sentinel', REDIS_SENTINELS="sentinel-1:26379,sentinel-2:26379",
+                       REDIS_SENTINEL_MASTER='reviewfy', REDIS_MAX_CONNECTIONS=10)
+    def test_sentinel_client(self):
+        with mock.patch.object(redis_connection_utils, 'Sentinel') as sentinel:
+            client = create_redis_client()
 
+        self.assertEqual(sentinel.call_args.args[0], [('sentinel-1', 26379), ('sentinel-2', 26379)])
+        master_for = sentinel.return_value.master_for
+        self.assertEqual(master_for.call_args.args, ('reviewfy',))
+        self.assertEqual(master_for.call_args.kwargs['max_connections'], 10)
+        self.assertIs(client, master_for.return_value)
 
+    def test_pools_are_reset_after_fork(self):
+        client = redis_connection_utils._track(mock.Mock(spec=['connection_pool']))
+        redis_connection_utils._reset_after_fork()
+        client.connection_pool.reset.assert_called_once_with()
 
+    @override_settings(REDIS_MODE='replicated')
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            create_redis_client()
@@ -1,8 +1,12 @@
 from django.urls import path
-from .views import ArticleListView, RatingCreateView, ArticleCreateView
+from .async_views import AsyncArticleListView, AsyncRatingCreateView
+from .views import ArticleListView, RatingCreateView, RatingBulkCreateView, ArticleCreateView
 
 urlpatterns = [
     path('', ArticleListView.as_view(), name='article-list'),
     path('rate/', RatingCreateView.as_view(), name='article-rate'),
+    path('rate/bulk/', RatingBulkCreateView.as_view(), name='article-rate-bulk'),
+    path('async/', AsyncArticleListView.as_view(), name='article-list-async'),
+    path('async/rate/', AsyncRatingCreateView.as_view(), name='article-rate-async'),
     path('create/', ArticleCreateView.as_view(), name='article-create'),
 ]
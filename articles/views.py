@@ -1,14 +1,46 @@
 from django.conf import settings
 from rest_framework import generics
-from utils.cache_utils import get_or_set_cache
-from utils.redis_utils import add_rating_to_redis
+from utils.article_cache_utils import get_articles_page, get_user_ratings, add_article_to_cache
+from utils.article_ids_utils import article_exists, existing_article_ids
+from utils.rate_limit_utils import check_rating_admission
+from utils.redis_utils import enqueue_rating, enqueue_ratings
 from rest_framework.permissions import IsAuthenticated
 from .serializers import RatingSerializer
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Article, Rating
+from rest_framework.utils.urls import replace_query_param
+from .models import Article
 from .serializers import ArticleSerializer
-from django.core.exceptions import ObjectDoesNotExist
+
+
+def split_articles_page(request, articles, page_size):
+    if len(articles) <= page_size:
+        return articles, None
+
+    articles = articles[:page_size]
+    return articles, replace_query_param(request.build_absolute_uri(), 'cursor', articles[-1][0])
+
+
+def article_results(articles, user_ratings):
+    response_data = []
+
+    for article_id, title, ratings_count, avg_rating in articles:
+        article_data = {
+            "id": article_id,
+            "title": title,
+            "ratings_count": ratings_count,
+            "avg_rating": avg_rating,
+            "user_rating": user_ratings.get(article_id, "No rating")
+        }
+
+        response_data.append(article_data)
+
+    return response_data
+
+
+def rejected_rating_response(rejection):
+    status_code, detail, retry_after = rejection
+    return Response({"detail": detail}, status=status_code, headers={'Retry-After': str(retry_after)})
 
 
 class ArticleListView(generics.ListAPIView):
@@ -17,38 +49,31 @@ class ArticleListView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
 
     def list(self, request, *args, **kwargs):
+        cursor = request.query_params.get('cursor', '0')
+
+        if not cursor.isdigit():
+            return Response({"detail": "Cursor must be a valid integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        cursor = int(cursor)
+        page_size = settings.ARTICLES_PAGE_SIZE
+
         try:
-            articles = get_or_set_cache('articles_list', self.get_queryset(),
-                                        timeout=settings.ARTICLES_LIST_CACHE_TIMEOUT)
+            articles = get_articles_page(cursor, page_size)
         except Exception as e:
             return Response({"detail": f"Error fetching articles: {str(e)}"},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        response_data = []
-
-        for article in articles:
-            ratings_count = article.ratings_count
-            avg_rating = article.avg_rating
-
-            try:
-                user_rating_obj = Rating.objects.get(article=article, user=request.user)
-                user_rating = user_rating_obj.score
-            except Rating.DoesNotExist:
-                user_rating = "No rating"
-            except Exception as e:
-                return Response({"detail": f"Error fetching user rating: {str(e)}"},
-                                status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        articles, next_url = split_articles_page(request, articles, page_size)
 
-            article_data = {
-                "title": article.title,
-                "ratings_count": ratings_count,
-                "avg_rating": float(avg_rating),
-                "user_rating": user_rating
-            }
+        try:
+            user_ratings = get_user_ratings(request.user.id, [article[0] for article in articles])
+        except Exception as e:
+            return Response({"detail": f"Error fetching user rating: {str(e)}"},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            response_data.append(article_data)
+        response_data = article_results(articles, user_ratings)
 
-        return Response(response_data, status=status.HTTP_200_OK)
+        return Response({"next": next_url, "results": response_data}, status=status.HTTP_200_OK)
 
 
 class ArticleCreateView(generics.CreateAPIView):
@@ -56,6 +81,34 @@ class ArticleCreateView(generics.CreateAPIView):
     serializer_class = ArticleSerializer
     permission_classes = [IsAuthenticated]
 
+    def perform_create(self, serializer):
+        article = serializer.save()
+        add_article_to_cache(article)
+
+
+def parse_rating(data):
+    if not isinstance(data, dict):
+        return None, None, "Rating must be an object."
+
+    article_id = data.get('article')
+    score = data.get('score')
+
+    if not article_id or not score:
+        return None, None, "Article and score are required."
+
+    if not isinstance(score, str) or not score.isdigit():
+        return None, None, "Score must be a valid integer."
+
+    if not str(article_id).isdigit():
+        return None, None, "Article must be a valid integer."
+
+    score = int(score)
+
+    if score < 0 or score > 5:
+        return None, None, "Score must be between 0 and 5."
+
+    return int(article_id), score, None
+
 
 class RatingCreateView(generics.CreateAPIView):
     serializer_class = RatingSerializer
@@ -63,25 +116,64 @@ class RatingCreateView(generics.CreateAPIView):
 
     def post(self, request, *args, **kwargs):
         user = request.user
-        article_id = request.data.get('article')
-        score = request.data.get('score')
-
-        if not article_id or not score:
-            return Response({"detail": "Article and score are required."}, status=status.HTTP_400_BAD_REQUEST)
+        article_id, score, error = parse_rating(request.data)
 
-        if not isinstance(score, str) or not score.isdigit():
-            return Response({"detail": "Score must be a valid integer."}, status=status.HTTP_400_BAD_REQUEST)
+        if error:
+            return Response({"detail": error}, status=status.HTTP_400_BAD_REQUEST)
 
-        score = int(score)
+        rejection = check_rating_admission(user.id, [article_id])
+        if rejection:
+            return rejected_rating_response(rejection)
 
-        if score < 0 or score > 5:
-            return Response({"detail": "Score must be between 0 and 5."}, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            Article.objects.get(pk=article_id)
-        except ObjectDoesNotExist:
+        if not article_exists(article_id):
             return Response({"detail": f"Article {article_id} not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        add_rating_to_redis(article_id, user.id, score, rating_type='unprocessed')
+        enqueue_rating(article_id, user.id, score)
 
         return Response({"detail": "Rating added successfully."}, status=status.HTTP_201_CREATED)
+
+
+class RatingBulkCreateView(generics.GenericAPIView):
+    serializer_class = RatingSerializer
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        user = request.user
+        items = request.data.get('ratings') if isinstance(request.data, dict) else None
+
+        if not isinstance(items, list) or not items:
+            return Response({"detail": "Ratings must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if len(items) > settings.RATING_BULK_MAX_ITEMS:
+            return Response({"detail": f"At most {settings.RATING_BULK_MAX_ITEMS} ratings can be submitted at once."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        parsed = [parse_rating(item) for item in items]
+        valid_ids = [article_id for article_id, _, error in parsed if not error]
+
+        if valid_ids:
+            rejection = check_rating_admission(user.id, valid_ids)
+            if rejection:
+                return rejected_rating_response(rejection)
+
+        existing_ids = existing_article_ids(valid_ids)
+
+        results = []
+        ratings = {}
+        for item, (article_id, score, error) in zip(items, parsed):
+            if error:
+                results.append({"article": item.get('article') if isinstance(item, dict) else None,
+                                "status": status.HTTP_400_BAD_REQUEST, "detail": error})
+            elif article_id not in existing_ids:
+                results.append({"article": article_id, "status": status.HTTP_404_NOT_FOUND,
+                                "detail": f"Article {article_id} not found."})
+            else:
+                # Later ratings of the same article replace earlier ones, as they would in the queue.
+                ratings[article_id] = score
+                results.append({"article": article_id, "status": status.HTTP_201_CREATED,
+                                "detail": "Rating added successfully."})
+
+        if ratings:
+            enqueue_ratings(user.id, list(ratings.items()))
+
+        return Response({"accepted": len(ratings), "results": results}, status=status.HTTP_200_OK)
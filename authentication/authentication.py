@@ -0,0 +1,17 @@
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+
+from utils.auth_utils import is_user_active
+
+
+# Trusts the user id of the signed token instead of loading the user on every request. Only the user's active
+# flag is checked, from a short-lived cache that is updated as soon as a user is deactivated or deleted.
+class CachedStatelessJWTAuthentication(JWTStatelessUserAuthentication):
+
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+
+        if not is_user_active(user.id):
+            raise AuthenticationFailed("User is inactive or was deleted.", code='user_inactive')
+
+        return user
@@ -0,0 +1,15 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from utils.auth_utils import set_user_active
+
+
+@receiver(post_save, sender=User)
+def update_user_active(sender, instance, **kwargs):
+    set_user_active(instance.pk, instance.is_active)
+
+
+@receiver(post_delete, sender=User)
+def revoke_deleted_user(sender, instance, **kwargs):
+    set_user_active(instance.pk, False)
@@ -1,5 +1,14 @@
 from rest_framework.test import APITestCase
 from rest_framework import status
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.views import APIView
+from utils.auth_utils import get_user_active_key
+from .authentication import CachedStatelessJWTAuthentication
 
 
 class AuthTests(APITestCase):
@@ -35,3 +44,47 @@ class AuthTests(APITestCase):
         response = self.client.post('/api/auth/refresh/', {'refresh': 'invalidtoken'}, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data['detail'], "Invalid or expired refresh token.")
+
+
+@override_settings(CACHE_ENABLED=False)
+class StatelessAuthTests(APITestCase):
+
+    def setUp(self):
+        # View classes read the authentication classes when they are defined, so they are patched directly.
+        patcher = mock.patch.object(APIView, 'authentication_classes', [CachedStatelessJWTAuthentication])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.client.post('/api/auth/register/', {'username': 'testuser', 'password': 'testpassword'}, format='json')
+        response = self.client.post('/api/auth/login/', {'username': 'testuser', 'password': 'testpassword'},
+                                    format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+        self.user = User.objects.get(username='testuser')
+
+    def tearDown(self):
+        cache.delete(get_user_active_key(self.user.pk))
+
+    def test_authenticated_request_skips_user_query(self):
+        cache.delete(get_user_active_key(self.user.pk))
+        self.client.get('/api/articles/')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/articles/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(any('"auth_user"' in query['sql'] for query in queries.captured_queries))
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get('/api/articles/')
+        self.user.is_active = False
+        self.user.save()
+
+        response = self.client.get('/api/articles/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_user_is_rejected(self):
+        self.client.get('/api/articles/')
+        self.user.delete()
+
+        response = self.client.get('/api/articles/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 from datetime import timedelta
 
@@ -35,9 +36,14 @@ INSTALLED_APPS = [
     'articles'
 ]
 
+# Authenticate from the token claims without loading the user, checking only a cached active flag
+JWT_STATELESS_AUTHENTICATION = os.getenv('JWT_STATELESS_AUTHENTICATION', 'False') == 'True'
+JWT_USER_STATE_CACHE_TIMEOUT = int(os.getenv('JWT_USER_STATE_CACHE_TIMEOUT', 60))
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'authentication.authentication.CachedStatelessJWTAuthentication' if JWT_STATELESS_AUTHENTICATION
+        else 'rest_framework_simplejwt.authentication.JWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -105,7 +111,11 @@ CACHES = {
 
 CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'True') == 'True'
 CACHE_DEFAULT_TIMEOUT = int(os.getenv('CACHE_DEFAULT_TIMEOUT', 120))
-ARTICLES_LIST_CACHE_TIMEOUT=int(os.getenv('ARTICLES_LIST_CACHE_TIMEOUT', 60))
+CACHE_STALE_TIMEOUT = int(os.getenv('CACHE_STALE_TIMEOUT', 30))
+CACHE_LOCK_TIMEOUT = int(os.getenv('CACHE_LOCK_TIMEOUT', 10))
+CACHE_LOCK_WAIT = float(os.getenv('CACHE_LOCK_WAIT', 2))
+ARTICLES_LIST_CACHE_TIMEOUT=int(os.getenv('ARTICLES_LIST_CACHE_TIMEOUT', 600))
+ARTICLES_PAGE_SIZE = int(os.getenv('ARTICLES_PAGE_SIZE', 50))
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -138,9 +148,74 @@ USE_TZ = True
 
 REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
 REDIS_PORT = os.getenv('REDIS_PORT', '6379')
+REDIS_DB = int(os.getenv('REDIS_DB', 0))
+REDIS_PASSWORD = os.getenv('REDIS_PASSWORD', '')
+# standalone, sentinel or cluster
+REDIS_MODE = os.getenv('REDIS_MODE', 'standalone')
+# Comma separated host:port lists. Cluster mode falls back to REDIS_HOST and REDIS_PORT.
+REDIS_SENTINELS = os.getenv('REDIS_SENTINELS', '')
+REDIS_SENTINEL_MASTER = os.getenv('REDIS_SENTINEL_MASTER', 'mymaster')
+REDIS_CLUSTER_NODES = os.getenv('REDIS_CLUSTER_NODES', '')
+# Each process has one sync and one async connection pool, waiting at most REDIS_POOL_TIMEOUT seconds for a free
+# connection. Idle connections are checked every REDIS_HEALTH_CHECK_INTERVAL seconds before being reused.
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 5))
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', 5))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(os.getenv('REDIS_SOCKET_CONNECT_TIMEOUT', 5))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', 30))
+
+# The test suite deletes queues, counters and the article id set, so it runs against its own Redis database and
+# cache location instead of the configured ones.
+TESTING = sys.argv[1:2] == ['test']
+if TESTING:
+    REDIS_DB = int(os.getenv('REDIS_TEST_DB', 15))
+    # A cluster has no databases to choose from, so the tests only use one given in REDIS_TEST_CLUSTER_NODES.
+    REDIS_CLUSTER_NODES = os.getenv('REDIS_TEST_CLUSTER_NODES', '')
+    if REDIS_MODE == 'cluster' and not REDIS_CLUSTER_NODES:
+        REDIS_MODE = 'standalone'
+    CACHES['default']['LOCATION'] = os.getenv('REDIS_TEST_CACHE_LOCATION', f'redis://{REDIS_HOST}:{REDIS_PORT}/14')
 
 SUSPICION_THRESHOLD = float(os.getenv('SUSPICION_THRESHOLD', '0.5'))
 
+# Read spike and deviation features from the hourly rating histograms in Redis instead of the Rating table
+RATING_HISTOGRAM_ENABLED = os.getenv('RATING_HISTOGRAM_ENABLED', 'False') == 'True'
+
+# Read each user's last ratings from a profile cached in Redis instead of the Rating table
+USER_PROFILE_CACHE_ENABLED = os.getenv('USER_PROFILE_CACHE_ENABLED', 'True') == 'True'
+USER_PROFILE_CACHE_TIMEOUT = int(os.getenv('USER_PROFILE_CACHE_TIMEOUT', 24 * 60 * 60))
+
+# Articles are partitioned by id into this many shards, each processed by its own rating subtask
+RATING_TASK_SHARDS = int(os.getenv('RATING_TASK_SHARDS', 1))
+RATING_TASK_LOCK_TIMEOUT = int(os.getenv('RATING_TASK_LOCK_TIMEOUT', 60))
+# Re-run a shard right away when at least this many articles queued up while it was being processed
+RATING_TASK_ADAPTIVE = os.getenv('RATING_TASK_ADAPTIVE', 'True') == 'True'
+RATING_TASK_BACKLOG_THRESHOLD = int(os.getenv('RATING_TASK_BACKLOG_THRESHOLD', 50))
+
+# 'hash' queues ratings in per-article Redis hashes, 'stream' in a Redis Stream consumed by a consumer group
+RATING_INGEST_MODE = os.getenv('RATING_INGEST_MODE', 'hash')
+RATING_STREAM_MAXLEN = int(os.getenv('RATING_STREAM_MAXLEN', 1000000))
+RATING_STREAM_CONSUMERS = int(os.getenv('RATING_STREAM_CONSUMERS', 4))
+RATING_STREAM_BATCH_SIZE = int(os.getenv('RATING_STREAM_BATCH_SIZE', 1000))
+RATING_STREAM_MAX_BATCHES = int(os.getenv('RATING_STREAM_MAX_BATCHES', 10))
+RATING_STREAM_CLAIM_IDLE_MS = int(os.getenv('RATING_STREAM_CLAIM_IDLE_MS', 60000))
+
+RATING_BULK_MAX_ITEMS = int(os.getenv('RATING_BULK_MAX_ITEMS', 500))
+
+# Token buckets per user and per article: refill rate in ratings per second and burst capacity
+RATING_RATE_LIMIT_ENABLED = os.getenv('RATING_RATE_LIMIT_ENABLED', 'True') == 'True'
+RATING_USER_RATE = float(os.getenv('RATING_USER_RATE', 5))
+RATING_USER_BURST = int(os.getenv('RATING_USER_BURST', 50))
+RATING_ARTICLE_RATE = float(os.getenv('RATING_ARTICLE_RATE', 500))
+RATING_ARTICLE_BURST = int(os.getenv('RATING_ARTICLE_BURST', 2000))
+# Reject new ratings with 503 while this many ratings wait in Redis to be classified or committed, 0 disables the
+# check
+RATING_MAX_BACKLOG = int(os.getenv('RATING_MAX_BACKLOG', 100000))
+RATING_BACKLOG_RETRY_AFTER = int(os.getenv('RATING_BACKLOG_RETRY_AFTER', 30))
+
+# Set once the Rating table was converted with `manage.py partition_ratings --setup` (PostgreSQL only)
+RATING_PARTITIONING_ENABLED = os.getenv('RATING_PARTITIONING_ENABLED', 'False') == 'True'
+RATING_PARTITION_MONTHS_AHEAD = int(os.getenv('RATING_PARTITION_MONTHS_AHEAD', 3))
+
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
 CELERY_ACCEPT_CONTENT = os.getenv("CELERY_ACCEPT_CONTENT", "json").split(",")
 CELERY_TASK_SERIALIZER = os.getenv("CELERY_TASK_SERIALIZER", "json")
@@ -151,14 +226,22 @@ CELERY_BEAT_SCHEDULE = {
     'process_suspicious_ratings_every_2_minute': {
         'task': 'articles.tasks.process_suspicious_ratings',
         'schedule': 120.0,
+        'options': {'expires': 120.0},
     },
     'process_redis_ratings_every_30_seconds': {
         'task': 'articles.tasks.process_unprocessed_ratings',
         'schedule': 30.0,
+        'options': {'expires': 30.0},
     },
     'process_normal_ratings_every_1_minute': {
         'task': 'articles.tasks.process_normal_ratings',
         'schedule': 60.0,
+        'options': {'expires': 60.0},
+    },
+    'create_rating_partitions_every_day': {
+        'task': 'articles.tasks.create_future_rating_partitions',
+        'schedule': 24 * 60 * 60.0,
+        'options': {'expires': 24 * 60 * 60.0},
     },
 }
 
@@ -0,0 +1,116 @@
+import argparse
+import http.client
+import json
+import random
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+ENDPOINTS = {
+    'sync': {'list': '/api/articles/', 'rate': '/api/articles/rate/'},
+    'async': {'list': '/api/articles/async/', 'rate': '/api/articles/async/rate/'},
+}
+
+
+def connect(base_url):
+    url = urlsplit(base_url)
+    connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+    return connection_class(url.hostname, url.port, timeout=30)
+
+
+def send(connection, method, path, token=None, body=None):
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f"Bearer {token}"
+    connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = connection.getresponse()
+    return response.status, response.read()
+
+
+def login(base_url, username, password):
+    connection = connect(base_url)
+    credentials = {'username': username, 'password': password}
+    send(connection, 'POST', '/api/auth/register/', body=credentials)
+    status, content = send(connection, 'POST', '/api/auth/login/', body=credentials)
+    if status != 200:
+        raise SystemExit(f"Login failed with status {status}: {content[:200]}")
+    return json.loads(content)['access']
+
+
+def worker(base_url, method, path, token, article_id, deadline, results):
+    connection = connect(base_url)
+    while time.perf_counter() < deadline:
+        body = {'article': article_id, 'score': str(random.randint(0, 5))} if method == 'POST' else None
+        started_at = time.perf_counter()
+        try:
+            status, _ = send(connection, method, path, token, body)
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = connect(base_url)
+            status = None
+        results.append((time.perf_counter() - started_at, status))
+
+
+def percentile(latencies, fraction):
+    if not latencies:
+        return 0.0
+    return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1000
+
+
+def benchmark(stack, base_url, endpoint, tokens, args):
+    method = 'POST' if endpoint == 'rate' else 'GET'
+    path = ENDPOINTS[stack][endpoint]
+    results = []
+    deadline = time.perf_counter() + args.duration
+    threads = [threading.Thread(target=worker, args=(base_url, method, path, tokens[i % len(tokens)], args.article,
+                                                     deadline, results))
+               for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies = sorted(latency for latency, _ in results)
+    # Rate limited and shed requests are counted apart from errors: they are answered without doing the work.
+    limited = sum(1 for _, status in results if status in (429, 503))
+    errors = sum(1 for _, status in results if status is None or status >= 400) - limited
+    return {
+        'requests': len(results),
+        'limited': limited,
+        'errors': errors,
+        'rps': (len(results) - limited) / args.duration,
+        'mean_ms': statistics.mean(latencies) * 1000 if latencies else 0.0,
+        'p50_ms': percentile(latencies, 0.5),
+        'p99_ms': percentile(latencies, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the throughput of the sync (WSGI) and async (ASGI) "
+                                                 "article endpoints.")
+    parser.add_argument('--sync-url', default='http://localhost:8000')
+    parser.add_argument('--async-url', default='http://localhost:8001')
+    parser.add_argument('--article', type=int, default=1, help="Id of an existing article to rate.")
+    parser.add_argument('--endpoints', nargs='+', choices=['list', 'rate'], default=['list', 'rate'])
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=20.0, help="Seconds per endpoint and stack.")
+    parser.add_argument('--users', type=int, default=None,
+                        help="Number of users the requests are spread over, defaults to the concurrency.")
+    parser.add_argument('--username', default='benchmark', help="Prefix of the benchmark usernames.")
+    parser.add_argument('--password', default='benchmark-password')
+    args = parser.parse_args()
+
+    tokens = [login(args.sync_url, f"{args.username}-{i}", args.password) for i in range(args.users or args.concurrency)]
+
+    print(f"{'stack':<6} {'endpoint':<8} {'requests':>9} {'limited':>8} {'errors':>7} {'req/s':>9} {'mean ms':>8} "
+          f"{'p50 ms':>8} {'p99 ms':>8}")
+    for endpoint in args.endpoints:
+        for stack, base_url in (('sync', args.sync_url), ('async', args.async_url)):
+            result = benchmark(stack, base_url, endpoint, tokens, args)
+            print(f"{stack:<6} {endpoint:<8} {result['requests']:>9} {result['limited']:>8} {result['errors']:>7} "
+                  f"{result['rps']:>9.1f} {result['mean_ms']:>8.1f} {result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
+from articles.models import Article, Rating
+from utils.cache_utils import get_or_set_cache, update_cache
+from utils.redis_utils import redis_client
+
+
+def get_articles_page_cache_key(cursor, page_size):
+    return f"articles_list:{cursor}:{page_size}"
+
+
+def get_articles_cursor_key(cursor, page_size):
+    return f"articles_list:cursor:{cursor}:{page_size}"
+
+
+def get_article_page_index_key(article_id):
+    return f"articles_list:page_of:{article_id}"
+
+
+def _index_page(page_key, article_ids):
+    # An article can be on several cached pages (e.g. after articles were created or deleted), so each article
+    # keeps the set of page keys it was cached under and every one of them is patched.
+    timeout = settings.ARTICLES_LIST_CACHE_TIMEOUT + settings.CACHE_STALE_TIMEOUT
+    pipe = redis_client.pipeline(transaction=False)
+    for article_id in article_ids:
+        pipe.sadd(get_article_page_index_key(article_id), page_key)
+        pipe.expire(get_article_page_index_key(article_id), timeout)
+    pipe.execute()
+
+
+def _indexed_pages(article_id):
+    page_keys = redis_client.smembers(get_article_page_index_key(article_id))
+    return sorted(page_key.decode('utf-8') for page_key in page_keys)
+
+
+def _article_row(article):
+    return [article.pk, article.title, article.ratings_count, float(article.avg_rating)]
+
+
+def _dumps(snapshot):
+    return json.dumps(snapshot, separators=(',', ':')).encode('utf-8')
+
+
+def build_articles_page(cursor, page_size, cached=True):
+    rows = Article.objects.filter(pk__gt=cursor).order_by('pk').values_list(
+        'id', 'title', 'ratings_count', 'avg_rating'
+    )[:page_size + 1]
+    snapshot = [[pk, title, ratings_count, float(avg_rating)] for pk, title, ratings_count, avg_rating in rows]
+
+    if cached and settings.CACHE_ENABLED:
+        timeout = settings.ARTICLES_LIST_CACHE_TIMEOUT + settings.CACHE_STALE_TIMEOUT
+        _index_page(get_articles_page_cache_key(cursor, page_size), [row[0] for row in snapshot[:page_size]])
+        if len(snapshot) > page_size:
+            cache.set(get_articles_cursor_key(snapshot[page_size - 1][0], page_size), 1, timeout=timeout)
+
+    return _dumps(snapshot)
+
+
+def get_articles_page(cursor, page_size):
+    # Only the first page and cursors handed out in the next link of a cached page are cached. Any other cursor
+    # is served from the database, so clients cannot create a cache entry per cursor value.
+    if cursor and settings.CACHE_ENABLED and cache.get(get_articles_cursor_key(cursor, page_size)) is None:
+        return json.loads(build_articles_page(cursor, page_size, cached=False))
+
+    snapshot = get_or_set_cache(get_articles_page_cache_key(cursor, page_size),
+                                lambda: build_articles_page(cursor, page_size),
+                                timeout=settings.ARTICLES_LIST_CACHE_TIMEOUT)
+    return json.loads(snapshot)
+
+
+def get_user_ratings(user_id, article_ids):
+    return dict(
+        Rating.objects.filter(user_id=user_id, article_id__in=article_ids).values_list('article_id', 'score')
+    )
+
+
+async def async_get_user_ratings(user_id, article_ids):
+    return {
+        article_id: score async for article_id, score in
+        Rating.objects.filter(user_id=user_id, article_id__in=article_ids).values_list('article_id', 'score')
+    }
+
+
+def update_article_in_cache(article):
+    if not settings.CACHE_ENABLED:
+        return
+
+    def patch(snapshot):
+        rows = json.loads(snapshot)
+        for i, row in enumerate(rows):
+            if row[0] == article.pk:
+                rows[i] = _article_row(article)
+        return _dumps(rows)
+
+    for page_key in _indexed_pages(article.pk):
+        update_cache(page_key, patch)
+
+
+def add_article_to_cache(article):
+    if not settings.CACHE_ENABLED:
+        return
+
+    page_size = settings.ARTICLES_PAGE_SIZE
+    previous_id = Article.objects.filter(pk__lt=article.pk).order_by('-pk').values_list('pk', flat=True).first()
+
+    if previous_id is None:
+        page_keys = [get_articles_page_cache_key(0, page_size)]
+    else:
+        page_keys = _indexed_pages(previous_id)
+
+    for page_key in page_keys:
+        def append(snapshot, page_key=page_key):
+            rows = json.loads(snapshot)
+            if len(rows) <= page_size and all(row[0] < article.pk for row in rows):
+                rows.append(_article_row(article))
+            if len(rows) <= page_size:
+                _index_page(page_key, [article.pk])
+            else:
+                cache.set(get_articles_cursor_key(rows[page_size - 1][0], page_size), 1,
+                          timeout=settings.ARTICLES_LIST_CACHE_TIMEOUT + settings.CACHE_STALE_TIMEOUT)
+            return _dumps(rows)
+
+        update_cache(page_key, append)
@@ -0,0 +1,97 @@
+import logging
+
+import redis
+
+from articles.models import Article
+from utils.async_redis_utils import async_redis_client
+from utils.redis_utils import redis_client
+
+logger = logging.getLogger(__name__)
+
+ARTICLE_IDS_KEY = "article_ids"
+
+
+def add_article_ids(article_ids):
+    if not article_ids:
+        return
+    try:
+        redis_client.sadd(ARTICLE_IDS_KEY, *article_ids)
+    except redis.RedisError:
+        logger.exception("Failed to add article ids to the id set.")
+
+
+def remove_article_ids(article_ids):
+    if not article_ids:
+        return
+    try:
+        redis_client.srem(ARTICLE_IDS_KEY, *article_ids)
+    except redis.RedisError:
+        logger.exception("Failed to remove article ids from the id set.")
+
+
+def article_exists(article_id):
+    # The set only ever grows from committed articles, so a hit needs no database query. Misses fall back
+    # to the database, which also repopulates the set after a Redis restart.
+    try:
+        if redis_client.sismember(ARTICLE_IDS_KEY, article_id):
+            return True
+    except redis.RedisError:
+        logger.exception("Failed to read the article id set, checking the database.")
+
+    if not Article.objects.filter(pk=article_id).exists():
+        return False
+
+    add_article_ids([article_id])
+    return True
+
+
+async def async_article_exists(article_id):
+    try:
+        if await async_redis_client.sismember(ARTICLE_IDS_KEY, article_id):
+            return True
+    except redis.RedisError:
+        logger.exception("Failed to read the article id set, checking the database.")
+
+    if not await Article.objects.filter(pk=article_id).aexists():
+        return False
+
+    try:
+        await async_redis_client.sadd(ARTICLE_IDS_KEY, article_id)
+    except redis.RedisError:
+        logger.exception("Failed to add article ids to the id set.")
+    return True
+
+
+def existing_article_ids(article_ids):
+    article_ids = list(set(article_ids))
+    if not article_ids:
+        return set()
+
+    try:
+        flags = redis_client.smismember(ARTICLE_IDS_KEY, article_ids)
+    except redis.RedisError:
+        logger.exception("Failed to read the article id set, checking the database.")
+        flags = [False] * len(article_ids)
+
+    existing = {article_id for article_id, flag in zip(article_ids, flags) if flag}
+    missing = [article_id for article_id, flag in zip(article_ids, flags) if not flag]
+    if missing:
+        found = list(Article.objects.filter(pk__in=missing).values_list('pk', flat=True))
+        add_article_ids(found)
+        existing.update(found)
+
+    return existing
+
+
+def rebuild_article_ids(batch_size=10000):
+    pipe = redis_client.pipeline()
+    pipe.delete(ARTICLE_IDS_KEY)
+    batch = []
+    for article_id in Article.objects.order_by().values_list('pk', flat=True).iterator(chunk_size=batch_size):
+        batch.append(article_id)
+        if len(batch) >= batch_size:
+            pipe.sadd(ARTICLE_IDS_KEY, *batch)
+            batch = []
+    if batch:
+        pipe.sadd(ARTICLE_IDS_KEY, *batch)
+    pipe.execute()
@@ -0,0 +1,10 @@
+from utils.redis_connection_utils import create_async_redis_client
+from utils.redis_utils import queue_ratings
+
+# Connections are only opened on first use, and forgotten by forked children, so the pool is safe to create before
+# the server forks its workers.
+async_redis_client = create_async_redis_client()
+
+
+async def async_enqueue_ratings(user_id, ratings):
+    await queue_ratings(async_redis_client.pipeline(), user_id, ratings).execute()
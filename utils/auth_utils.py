@@ -0,0 +1,33 @@
+import logging
+
+import redis
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+def get_user_active_key(user_id):
+    return f"auth_user_active:{user_id}"
+
+
+def set_user_active(user_id, active):
+    try:
+        cache.set(get_user_active_key(user_id), active, timeout=settings.JWT_USER_STATE_CACHE_TIMEOUT)
+    except redis.RedisError:
+        logger.exception(f"Failed to cache the active flag of user {user_id}.")
+
+
+def is_user_active(user_id):
+    try:
+        active = cache.get(get_user_active_key(user_id))
+    except redis.RedisError:
+        logger.exception(f"Failed to read the cached active flag of user {user_id}, checking the database.")
+        active = None
+
+    if active is None:
+        active = User.objects.filter(pk=user_id, is_active=True).exists()
+        set_user_active(user_id, active)
+
+    return active
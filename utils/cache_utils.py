@@ -1,20 +1,113 @@
 # utils/cache_utils.py
+import logging
+import math
+import random
+import time
+
 from django.conf import settings
 from django.core.cache import cache
 
+logger = logging.getLogger(__name__)
+
+
+def _load(loader):
+    return loader() if callable(loader) else loader
+
+
+def _lock_key(key):
+    return f"{key}:lock"
+
+
+def _dirty_key(key):
+    return f"{key}:dirty"
+
+
+def _store(key, entry, timeout):
+    # Called with the lock held. The dirty marker is left by a patch that gave up waiting for the lock: the value
+    # written here may predate that patch, so it is dropped and rebuilt on the next read.
+    cache.set(key, entry, timeout=timeout)
+    if cache.get(_dirty_key(key)) is not None:
+        cache.delete_many([key, _dirty_key(key)])
+
+
+def _should_refresh(expires_at, delta, beta, now):
+    # Probabilistic early expiration (XFetch): the closer the entry is to its soft expiry and the
+    # more expensive it was to build, the more likely a single request refreshes it ahead of time.
+    return now - delta * beta * math.log(1.0 - random.random()) >= expires_at
+
 
+def _refresh(key, loader, timeout, stale_timeout):
+    started_at = time.time()
+    value = _load(loader)
+    delta = time.time() - started_at
+    _store(key, (value, started_at + delta + timeout, delta), timeout + stale_timeout)
+    return value
 
-def get_or_set_cache(key, queryset, timeout=None):
+
+def get_or_set_cache(key, loader, timeout=None, stale_timeout=None, beta=1.0):
     if not settings.CACHE_ENABLED:
-        return queryset
+        return _load(loader)
 
     if timeout is None:
-        timeout = settings.CACHE_TIMEOUT
+        timeout = settings.CACHE_DEFAULT_TIMEOUT
+
+    if stale_timeout is None:
+        stale_timeout = settings.CACHE_STALE_TIMEOUT
+
+    entry = cache.get(key)
+
+    if entry is not None:
+        value, expires_at, delta = entry
+        if not _should_refresh(expires_at, delta, beta, time.time()):
+            return value
+
+        if not cache.add(_lock_key(key), 1, timeout=settings.CACHE_LOCK_TIMEOUT):
+            return value
+
+        try:
+            return _refresh(key, loader, timeout, stale_timeout)
+        finally:
+            cache.delete(_lock_key(key))
+
+    if cache.add(_lock_key(key), 1, timeout=settings.CACHE_LOCK_TIMEOUT):
+        try:
+            return _refresh(key, loader, timeout, stale_timeout)
+        finally:
+            cache.delete(_lock_key(key))
+
+    deadline = time.time() + settings.CACHE_LOCK_WAIT
+    while time.time() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+
+    logger.warning(f"Timed out waiting for cache key {key} to be rebuilt, loading it directly.")
+    return _load(loader)
+
+
+def update_cache(key, updater):
+    if not settings.CACHE_ENABLED:
+        return
 
-    data = cache.get(key)
+    # Another worker is rebuilding or patching the entry and would write back a value without this patch, so
+    # wait for it. Deleting the entry alone is not enough: the lock holder has already read it.
+    deadline = time.time() + settings.CACHE_LOCK_WAIT
+    while not cache.add(_lock_key(key), 1, timeout=settings.CACHE_LOCK_TIMEOUT):
+        if time.time() >= deadline:
+            logger.warning(f"Timed out waiting to update cache key {key}, dropping it.")
+            cache.set(_dirty_key(key), 1, timeout=settings.CACHE_LOCK_TIMEOUT)
+            cache.delete(key)
+            return
+        time.sleep(0.05)
 
-    if not data:
-        data = queryset
-        cache.set(key, data, timeout=timeout)
+    try:
+        entry = cache.get(key)
+        if entry is None:
+            return
 
-    return data
+        value, expires_at, delta = entry
+        remaining = max(expires_at - time.time(), 0)
+        _store(key, (updater(value), expires_at, delta), remaining + settings.CACHE_STALE_TIMEOUT)
+    finally:
+        cache.delete(_lock_key(key))
@@ -0,0 +1,84 @@
+import logging
+import time
+
+import redis
+
+from utils.redis_utils import redis_client
+from utils.score_distribution import ScoreDistribution
+
+logger = logging.getLogger(__name__)
+
+HOUR = 3600
+HISTOGRAM_HOURS = 8 * 24
+
+
+def get_histogram_key(article_id):
+    return f"rating_histogram:{article_id}"
+
+
+def _hour(timestamp):
+    return int(timestamp // HOUR)
+
+
+def record_rating_changes(changes):
+    # changes: (article_id, created_at timestamp, score, count delta)
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for article_id, timestamp, score, count_delta in changes:
+            key = get_histogram_key(article_id)
+            pipe.hincrby(key, f"{_hour(timestamp)}:{score}", count_delta)
+            pipe.expire(key, HISTOGRAM_HOURS * HOUR)
+        pipe.execute()
+    except redis.RedisError:
+        logger.exception("Failed to record rating histogram changes.")
+
+
+def get_histogram(article_id, now=None):
+    current_hour = _hour(now if now is not None else time.time())
+    key = get_histogram_key(article_id)
+
+    histogram = {}
+    expired_fields = []
+    for field, value in redis_client.hgetall(key).items():
+        field = field.decode('utf-8')
+        hour, score = field.split(':')
+        if current_hour - int(hour) >= HISTOGRAM_HOURS or not score.isdigit():
+            expired_fields.append(field)
+            continue
+        # A changed rating decrements its old bucket, which goes negative if the bucket was never backfilled or was
+        # evicted, so such counters are read as empty.
+        histogram.setdefault(int(hour), ScoreDistribution()).add(int(score), max(int(value), 0))
+
+    if expired_fields:
+        redis_client.hdel(key, *expired_fields)
+
+    return current_hour, histogram
+
+
+def get_spike_counts(article_id, now=None):
+    current_hour, histogram = get_histogram(article_id, now)
+    past_hour = current_hour - 25
+    today = sum(bucket.count for hour, bucket in histogram.items() if hour >= past_hour)
+    past = histogram[past_hour].count if past_hour in histogram else 0
+    return today, past
+
+
+def get_score_distribution(article_id, hours=7 * 24, now=None):
+    current_hour, histogram = get_histogram(article_id, now)
+    distribution = ScoreDistribution()
+    for hour, bucket in histogram.items():
+        if current_hour - hour < hours:
+            distribution.merge(bucket)
+    return distribution
+
+
+def rebuild_histograms(rows):
+    # rows: (article_id, hour start datetime, score, count)
+    pipe = redis_client.pipeline(transaction=False)
+    for key in redis_client.scan_iter(match=get_histogram_key('*')):
+        pipe.delete(key)
+    for article_id, hour_start, score, count in rows:
+        key = get_histogram_key(article_id)
+        pipe.hset(key, f"{_hour(hour_start.timestamp())}:{score}", count)
+        pipe.expire(key, HISTOGRAM_HOURS * HOUR)
+    pipe.execute()
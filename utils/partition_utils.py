@@ -0,0 +1,140 @@
+import datetime
+import logging
+import re
+
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+RATING_TABLE = 'articles_rating'
+HISTORY_PARTITION = f"{RATING_TABLE}_history"
+UNPARTITIONED_TABLE = f"{RATING_TABLE}_unpartitioned"
+UPPER_BOUND_RE = re.compile(r"TO \('([^']+)'\)")
+
+
+def month_start(value):
+    value = value.astimezone(datetime.timezone.utc)
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(start, months):
+    month = start.month - 1 + months
+    return start.replace(year=start.year + month // 12, month=month % 12 + 1)
+
+
+def get_partition_name(start):
+    return f"{RATING_TABLE}_p{start:%Y_%m}"
+
+
+def is_rating_table_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))",
+                       [RATING_TABLE])
+        return cursor.fetchone()[0]
+
+
+def lock_rating_articles(article_ids):
+    # Upserts of the same article are serialized with transaction level advisory locks: SELECT ... FOR UPDATE
+    # cannot lock a rating that does not exist yet, and partitioned tables cannot keep the (user, article) unique
+    # constraint. Sorted to avoid deadlocks.
+    if connection.vendor != 'postgresql':
+        return
+
+    with connection.cursor() as cursor:
+        for article_id in sorted(article_ids):
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [article_id])
+
+
+def create_rating_partitions(months_ahead, now=None):
+    month = month_start(now or timezone.now())
+    created = []
+
+    with connection.cursor() as cursor:
+        for offset in range(months_ahead + 1):
+            start = add_months(month, offset)
+            name = get_partition_name(start)
+            cursor.execute("SELECT to_regclass(%s)", [name])
+            if cursor.fetchone()[0] is not None:
+                continue
+
+            cursor.execute(f"CREATE TABLE {name} PARTITION OF {RATING_TABLE} FOR VALUES FROM (%s) TO (%s)",
+                           [start, add_months(start, 1)])
+            created.append(name)
+
+    return created
+
+
+def setup_rating_partitions(months_ahead, now=None):
+    # Rebuilds articles_rating as a table partitioned by created_at month. Ratings older than the current month
+    # go to a single history partition. The table is locked while its rows are copied.
+    first_month = month_start(now or timezone.now())
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {RATING_TABLE} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(f"ALTER TABLE {RATING_TABLE} RENAME TO {UNPARTITIONED_TABLE}")
+        cursor.execute(f"CREATE TABLE {RATING_TABLE} (LIKE {UNPARTITIONED_TABLE}) PARTITION BY RANGE (created_at)")
+        cursor.execute(f"CREATE TABLE {HISTORY_PARTITION} PARTITION OF {RATING_TABLE} "
+                       f"FOR VALUES FROM (MINVALUE) TO (%s)", [first_month])
+        create_rating_partitions(months_ahead, now=first_month)
+
+        cursor.execute(f"INSERT INTO {RATING_TABLE} SELECT * FROM {UNPARTITIONED_TABLE}")
+        # Also drops the old id sequence, indexes and constraints, so their names can be reused below.
+        cursor.execute(f"DROP TABLE {UNPARTITIONED_TABLE}")
+
+        cursor.execute(f"CREATE SEQUENCE {RATING_TABLE}_id_seq OWNED BY {RATING_TABLE}.id")
+        cursor.execute(f"SELECT setval('{RATING_TABLE}_id_seq', COALESCE(MAX(id), 0) + 1, false) FROM {RATING_TABLE}")
+        cursor.execute(f"ALTER TABLE {RATING_TABLE} ALTER COLUMN id SET DEFAULT nextval('{RATING_TABLE}_id_seq')")
+
+        cursor.execute(f"ALTER TABLE {RATING_TABLE} ADD PRIMARY KEY (id, created_at)")
+        cursor.execute(f"ALTER TABLE {RATING_TABLE} ADD CONSTRAINT {RATING_TABLE}_article_id_fk "
+                       f"FOREIGN KEY (article_id) REFERENCES articles_article (id) DEFERRABLE INITIALLY DEFERRED")
+        cursor.execute(f"ALTER TABLE {RATING_TABLE} ADD CONSTRAINT {RATING_TABLE}_user_id_fk "
+                       f"FOREIGN KEY (user_id) REFERENCES auth_user (id) DEFERRABLE INITIALLY DEFERRED")
+        cursor.execute(f"CREATE INDEX {RATING_TABLE}_user_article_idx ON {RATING_TABLE} (user_id, article_id)")
+        cursor.execute(f"CREATE INDEX rating_article_created_idx ON {RATING_TABLE} (article_id, created_at) "
+                       f"INCLUDE (score)")
+        cursor.execute(f"CREATE INDEX rating_user_created_idx ON {RATING_TABLE} (user_id, created_at DESC) "
+                       f"INCLUDE (article_id, score)")
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"ANALYZE {RATING_TABLE}")
+
+
+def detach_rating_partitions(before, drop=False):
+    # Detached partitions become standalone tables that can be dumped and dropped. Their ratings are subtracted from
+    # the article aggregates in the same transaction, so a user re-rating such an article is only counted once.
+    # Detaching locks the rating table until commit, so no rating task upserts ratings meanwhile.
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+                       "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s)", [RATING_TABLE])
+        partitions = cursor.fetchall()
+
+    detached = []
+    article_ids = set()
+    for name, bound in sorted(partitions):
+        match = UPPER_BOUND_RE.search(bound)
+        if match is None or parse_datetime(match.group(1)) > before:
+            continue
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {RATING_TABLE} DETACH PARTITION {name}")
+            cursor.execute(
+                f"UPDATE articles_article a SET total_score = a.total_score - d.total_score, "
+                f"ratings_count = a.ratings_count - d.ratings_count, "
+                f"avg_rating = COALESCE(ROUND((a.total_score - d.total_score)::numeric "
+                f"/ NULLIF(a.ratings_count - d.ratings_count, 0), 2), 0), updated_at = now() "
+                f"FROM (SELECT article_id, SUM(score) AS total_score, COUNT(*) AS ratings_count FROM {name} "
+                f"GROUP BY article_id) d WHERE a.id = d.article_id RETURNING a.id"
+            )
+            article_ids.update(article_id for article_id, in cursor.fetchall())
+            if drop:
+                cursor.execute(f"DROP TABLE {name}")
+        logger.info(f"Detached rating partition {name}.")
+        detached.append(name)
+
+    return detached, article_ids
@@ -0,0 +1,124 @@
+import logging
+
+import redis
+from django.conf import settings
+
+from utils.redis_connection_utils import is_cluster_mode
+from utils.redis_utils import redis_client
+
+logger = logging.getLogger(__name__)
+
+PROFILE_LENGTH = 10
+
+# A profile is the comma separated "article_id:score" list of the user's most recent ratings, newest first.
+# New ratings are pushed to the front, re-ratings update the score in place since they keep their created_at.
+# Profiles that are not cached are left alone and are loaded from the database on the next read. Every change bumps
+# the user's profile version, so a profile loaded before the change is not cached (see FILL_PROFILE_SCRIPT).
+# KEYS: profile key, profile version key
+# ARGV: article id, score, 1 if the rating is new else 0, profile length, version timeout in seconds
+UPDATE_PROFILE_SCRIPT = redis_client.register_script("""
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+local profile = redis.call('GET', KEYS[1])
+if not profile then
+    return 0
+end
+local entries = {}
+for entry in string.gmatch(profile, '[^,]+') do
+    table.insert(entries, entry)
+end
+if ARGV[3] == '1' then
+    table.insert(entries, 1, ARGV[1] .. ':' .. ARGV[2])
+    while #entries > tonumber(ARGV[4]) do
+        table.remove(entries)
+    end
+else
+    for i, entry in ipairs(entries) do
+        if string.match(entry, '^(%d+):') == ARGV[1] then
+            entries[i] = ARGV[1] .. ':' .. ARGV[2]
+        end
+    end
+end
+redis.call('SET', KEYS[1], table.concat(entries, ','), 'KEEPTTL')
+return 1
+""")
+
+# Caches a profile loaded from the database, unless a rating of the user was committed since the version was read.
+# KEYS: profile key, profile version key
+# ARGV: profile, version read before loading ('' if none), profile timeout in seconds
+FILL_PROFILE_SCRIPT = redis_client.register_script("""
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[2] then
+    return 0
+end
+if redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3], 'NX') then
+    return 1
+end
+return 0
+""")
+
+
+def get_user_profile_key(user_id):
+    # The profile and its version share a hash slot in cluster mode.
+    return f"user_profile:{{{user_id}}}"
+
+
+def get_user_profile_version_key(user_id):
+    return f"user_profile:{{{user_id}}}:version"
+
+
+def _profile_keys(user_id):
+    return [get_user_profile_key(user_id), get_user_profile_version_key(user_id)]
+
+
+def _encode_profile(ratings):
+    return ','.join(f"{article_id}:{score}" for article_id, score in ratings)
+
+
+def _decode_scores(profile):
+    return [int(entry.split(':')[1]) for entry in profile.decode('utf-8').split(',') if entry]
+
+
+def _script_pipeline():
+    # Cluster pipelines never load scripts on the nodes, so in cluster mode scripts are called per key on the
+    # client, which loads them on NOSCRIPT.
+    return None if is_cluster_mode() else redis_client.pipeline(transaction=False)
+
+
+def record_user_ratings(changes):
+    # changes: (user_id, article_id, score, is_new) in commit order
+    try:
+        pipe = _script_pipeline()
+        for user_id, article_id, score, is_new in changes:
+            UPDATE_PROFILE_SCRIPT(keys=_profile_keys(user_id),
+                                  args=[article_id, score, 1 if is_new else 0, PROFILE_LENGTH,
+                                        settings.USER_PROFILE_CACHE_TIMEOUT], client=pipe)
+        if pipe is not None:
+            pipe.execute()
+    except redis.RedisError:
+        logger.exception("Failed to update user rating profiles.")
+
+
+def get_recent_user_scores(user_ids, load_recent_ratings):
+    pipe = redis_client.pipeline(transaction=False)
+    for user_id in user_ids:
+        pipe.get(get_user_profile_key(user_id))
+        pipe.get(get_user_profile_version_key(user_id))
+    values = pipe.execute()
+    profiles = dict(zip(user_ids, values[::2]))
+    versions = dict(zip(user_ids, values[1::2]))
+    recent_scores = {user_id: _decode_scores(profile) for user_id, profile in profiles.items() if profile is not None}
+
+    missing_user_ids = [user_id for user_id, profile in profiles.items() if profile is None]
+    if missing_user_ids:
+        loaded = load_recent_ratings(missing_user_ids)
+        pipe = _script_pipeline()
+        for user_id in missing_user_ids:
+            ratings = loaded.get(user_id, [])
+            recent_scores[user_id] = [score for _, score in ratings]
+            FILL_PROFILE_SCRIPT(keys=_profile_keys(user_id),
+                                args=[_encode_profile(ratings), versions[user_id] or '',
+                                      settings.USER_PROFILE_CACHE_TIMEOUT], client=pipe)
+        if pipe is not None:
+            pipe.execute()
+
+    return recent_scores
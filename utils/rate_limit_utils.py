@@ -0,0 +1,185 @@
+import logging
+import math
+import time
+from collections import Counter
+
+import redis
+from django.conf import settings
+from rest_framework import status
+
+from utils.async_redis_utils import async_redis_client
+from utils.redis_connection_utils import is_cluster_mode
+from utils.redis_utils import queue_pending_rating_counts, redis_client, sum_pending_rating_counts
+
+logger = logging.getLogger(__name__)
+
+BACKLOG_CHECK_INTERVAL = 1.0
+
+# Token buckets are refilled lazily from the time elapsed since they were last used and are only charged if
+# every bucket has enough tokens, so a rejected request costs nothing. A request costing more than a bucket's
+# capacity is accepted once the bucket is full and leaves it in debt, so large batches are not rejected forever
+# but still pay one token per rating.
+# KEYS: bucket hashes
+# ARGV: current time in seconds, then (refill rate per second, capacity, cost) per bucket
+# Returns the seconds to wait before the request can be accepted, 0 if it was accepted.
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local tokens = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local capacity = tonumber(ARGV[i * 3])
+    local required = math.min(tonumber(ARGV[i * 3 + 1]), capacity)
+    local bucket = redis.call('HMGET', key, 'tokens', 'updated_at')
+    local available = tonumber(bucket[1]) or capacity
+    local updated_at = tonumber(bucket[2]) or now
+    tokens[i] = math.min(capacity, available + math.max(0, now - updated_at) * rate)
+    if tokens[i] < required then
+        wait = math.max(wait, (required - tokens[i]) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local capacity = tonumber(ARGV[i * 3])
+    local left = tokens[i] - tonumber(ARGV[i * 3 + 1])
+    redis.call('HSET', key, 'tokens', left, 'updated_at', now)
+    redis.call('EXPIRE', key, math.ceil((capacity - left) / rate) + 1)
+end
+return '0'
+"""
+
+token_bucket_script = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+async_token_bucket_script = async_redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+
+_backlog_state = {'checked_at': float('-inf'), 'full': False}
+
+
+def get_user_bucket_key(user_id):
+    return f"rate_limit:user:{user_id}"
+
+
+def get_article_bucket_key(article_id):
+    return f"rate_limit:article:{article_id}"
+
+
+def _bucket_arguments(user_id, article_ids):
+    keys = [get_user_bucket_key(user_id)]
+    args = [time.time(), settings.RATING_USER_RATE, settings.RATING_USER_BURST, len(article_ids)]
+    for article_id, count in Counter(article_ids).items():
+        keys.append(get_article_bucket_key(article_id))
+        args.extend([settings.RATING_ARTICLE_RATE, settings.RATING_ARTICLE_BURST, count])
+    return keys, args
+
+
+def _bucket_calls(user_id, article_ids):
+    # The buckets live in different hash slots in cluster mode, so each one is checked by its own script call
+    # there. A rejected request may then still have charged the buckets checked before the one that rejected it.
+    keys, args = _bucket_arguments(user_id, article_ids)
+    if not is_cluster_mode():
+        return [(keys, args)]
+    return [([key], [args[0], *args[i * 3 + 1:i * 3 + 4]]) for i, key in enumerate(keys)]
+
+
+def _retry_after(wait):
+    return max(1, math.ceil(float(wait)))
+
+
+def acquire_rating_tokens(user_id, article_ids):
+    # Returns the seconds to wait before retrying, or 0 if the ratings may be queued. Fails open if Redis errors.
+    if not settings.RATING_RATE_LIMIT_ENABLED:
+        return 0
+
+    wait = 0.0
+    try:
+        for keys, args in _bucket_calls(user_id, article_ids):
+            wait = float(token_bucket_script(keys=keys, args=args))
+            if wait > 0:
+                break
+    except redis.RedisError:
+        logger.exception("Failed to check the rating rate limits.")
+        return 0
+    return _retry_after(wait) if wait > 0 else 0
+
+
+async def async_acquire_rating_tokens(user_id, article_ids):
+    if not settings.RATING_RATE_LIMIT_ENABLED:
+        return 0
+
+    wait = 0.0
+    try:
+        for keys, args in _bucket_calls(user_id, article_ids):
+            wait = float(await async_token_bucket_script(keys=keys, args=args))
+            if wait > 0:
+                break
+    except redis.RedisError:
+        logger.exception("Failed to check the rating rate limits.")
+        return 0
+    return _retry_after(wait) if wait > 0 else 0
+
+
+def _backlog_check_due():
+    # The backlog is counted at most once per BACKLOG_CHECK_INTERVAL per process, not on every request.
+    return settings.RATING_MAX_BACKLOG > 0 and time.monotonic() - _backlog_state['checked_at'] >= BACKLOG_CHECK_INTERVAL
+
+
+def _update_backlog_state(pending):
+    _backlog_state.update(checked_at=time.monotonic(), full=pending >= settings.RATING_MAX_BACKLOG)
+
+
+def is_rating_backlog_full():
+    if _backlog_check_due():
+        try:
+            counts = queue_pending_rating_counts(redis_client.pipeline(transaction=False)).execute()
+            _update_backlog_state(sum_pending_rating_counts(counts))
+        except redis.RedisError:
+            logger.exception("Failed to count the pending ratings.")
+            _update_backlog_state(0)
+
+    return settings.RATING_MAX_BACKLOG > 0 and _backlog_state['full']
+
+
+async def async_is_rating_backlog_full():
+    if _backlog_check_due():
+        try:
+            pipe = queue_pending_rating_counts(async_redis_client.pipeline(transaction=False))
+            _update_backlog_state(sum_pending_rating_counts(await pipe.execute()))
+        except redis.RedisError:
+            logger.exception("Failed to count the pending ratings.")
+            _update_backlog_state(0)
+
+    return settings.RATING_MAX_BACKLOG > 0 and _backlog_state['full']
+
+
+def _backlog_rejection():
+    return (status.HTTP_503_SERVICE_UNAVAILABLE, "Too many ratings are waiting to be processed, try again later.",
+            settings.RATING_BACKLOG_RETRY_AFTER)
+
+
+def _rate_limit_rejection(retry_after):
+    return status.HTTP_429_TOO_MANY_REQUESTS, "Too many ratings, try again later.", retry_after
+
+
+def check_rating_admission(user_id, article_ids):
+    # Returns None if the ratings may be queued, else (status code, detail, Retry-After seconds).
+    if is_rating_backlog_full():
+        return _backlog_rejection()
+
+    retry_after = acquire_rating_tokens(user_id, article_ids)
+    if retry_after:
+        return _rate_limit_rejection(retry_after)
+
+    return None
+
+
+async def async_check_rating_admission(user_id, article_ids):
+    if await async_is_rating_backlog_full():
+        return _backlog_rejection()
+
+    retry_after = await async_acquire_rating_tokens(user_id, article_ids)
+    if retry_after:
+        return _rate_limit_rejection(retry_after)
+
+    return None
@@ -2,53 +2,102 @@ import datetime
 import logging
 
 import numpy as np
+from django.conf import settings
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import RowNumber
 from django.utils import timezone
 
 from articles.models import Rating
+from utils.histogram_utils import get_score_distribution, get_spike_counts
+from utils.profile_utils import PROFILE_LENGTH, get_recent_user_scores
 
 logger = logging.getLogger(__name__)
 
 
-def calculate_suspicion(score, user, article):
-    suspicion_factor = 0.0
+def _get_spike_counts(article):
+    if settings.RATING_HISTOGRAM_ENABLED:
+        return get_spike_counts(article.pk)
+
     now = timezone.now()
     one_hour_ago_yesterday = now - datetime.timedelta(days=1, hours=1)
     one_hour_end_yesterday = now - datetime.timedelta(days=1)
 
-    today_ratings_count = Rating.objects.filter(
-        article=article, created_at__gte=one_hour_ago_yesterday
-    ).count()
+    window_counts = Rating.objects.filter(article=article, created_at__gte=one_hour_ago_yesterday).aggregate(
+        today=Count('id'),
+        past=Count('id', filter=Q(created_at__lt=one_hour_end_yesterday)),
+    )
+    return window_counts['today'], window_counts['past']
+
+
+def _get_recent_score_stats(article):
+    if settings.RATING_HISTOGRAM_ENABLED:
+        distribution = get_score_distribution(article.pk)
+        return distribution.count, distribution.mean, distribution.std
+
+    recent_scores = list(Rating.objects.filter(
+        article=article,
+        created_at__gte=timezone.now() - datetime.timedelta(days=7)
+    ).values_list('score', flat=True))
+
+    if not recent_scores:
+        return 0, 0.0, 0.0
+
+    return len(recent_scores), np.mean(recent_scores), np.std(recent_scores)
+
+
+def _load_recent_user_ratings(user_ids):
+    recent_ratings = Rating.objects.filter(user_id__in=user_ids).annotate(
+        row_number=Window(RowNumber(), partition_by=[F('user_id')], order_by=F('created_at').desc())
+    ).filter(row_number__lte=PROFILE_LENGTH).order_by('user_id', 'row_number').values_list(
+        'user_id', 'article_id', 'score'
+    )
 
-    past_ratings_count = Rating.objects.filter(
-        article=article, created_at__gte=one_hour_ago_yesterday, created_at__lt=one_hour_end_yesterday
-    ).count()
+    loaded = {}
+    for user_id, article_id, score in recent_ratings:
+        loaded.setdefault(user_id, []).append((article_id, score))
+    return loaded
 
+
+def _get_recent_user_scores(user_ids):
+    if settings.USER_PROFILE_CACHE_ENABLED:
+        return get_recent_user_scores(user_ids, _load_recent_user_ratings)
+
+    loaded = _load_recent_user_ratings(user_ids)
+    return {user_id: [score for _, score in loaded.get(user_id, [])] for user_id in user_ids}
+
+
+def calculate_suspicion_batch(article, ratings):
+    if not ratings:
+        return {}
+
+    today_ratings_count, past_ratings_count = _get_spike_counts(article)
+
+    spike_factor = 0.0
     if past_ratings_count > 0:
         ratings_diff = today_ratings_count - past_ratings_count
         percentage_diff = abs(ratings_diff / past_ratings_count) * 100
 
         if percentage_diff > 100:
-            suspicion_factor += min(np.log(percentage_diff / 100) / 5, 0.5)
+            spike_factor += min(np.log(percentage_diff / 100) / 5, 0.5)
 
-    user_recent_ratings = Rating.objects.filter(
-        user=user
-    ).order_by('-created_at')[:10]
+    user_ids = list(ratings)
+    recent_user_scores = _get_recent_user_scores(user_ids)
 
-    zero_five_count = sum([1 for rating in user_recent_ratings if rating.score == 0 or rating.score == 5])
-    if zero_five_count > 0:
-        suspicion_factor += min(zero_five_count * 0.05, 0.3)
+    scores = np.array([ratings[user_id] for user_id in user_ids], dtype=float)
+    zero_five = np.array([sum(1 for score in recent_user_scores[user_id] if score == 0 or score == 5)
+                          for user_id in user_ids], dtype=float)
 
-    recent_ratings = Rating.objects.filter(
-        article=article,
-        created_at__gte=timezone.now() - datetime.timedelta(days=7)
-    ).values('score')
+    suspicion_factors = np.full(len(user_ids), spike_factor)
+    suspicion_factors += np.minimum(zero_five * 0.05, 0.3)
+
+    recent_count, mean_score, std_dev = _get_recent_score_stats(article)
 
-    if len(recent_ratings) > 2:
-        scores = [rating['score'] for rating in recent_ratings]
-        mean_score = np.mean(scores)
-        std_dev = np.std(scores)
+    if recent_count > 2:
+        deviation = np.abs(scores - mean_score)
 
-        if abs(score - mean_score) > std_dev:
-            suspicion_factor += min((abs(score - mean_score) / std_dev) * 0.1, 0.5)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            deviation_factors = np.minimum((deviation / std_dev) * 0.1, 0.5)
+        suspicion_factors += np.where(deviation > std_dev, deviation_factors, 0.0)
 
-    return min(suspicion_factor, 1.0)
+    suspicion_factors = np.minimum(suspicion_factors, 1.0)
+    return {user_id: float(factor) for user_id, factor in zip(user_ids, suspicion_factors)}
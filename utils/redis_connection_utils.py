@@ -0,0 +1,134 @@
+import os
+import weakref
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from redis.asyncio.cluster import ClusterNode as AsyncClusterNode, RedisCluster as AsyncRedisCluster
+from redis.asyncio.sentinel import Sentinel as AsyncSentinel
+from redis.cluster import ClusterNode, RedisCluster
+from redis.sentinel import Sentinel
+
+REDIS_MODES = ('standalone', 'sentinel', 'cluster')
+
+_clients = weakref.WeakSet()
+
+
+def is_cluster_mode():
+    return settings.REDIS_MODE == 'cluster'
+
+
+def parse_redis_nodes(value):
+    # "host:port,host:port" -> [(host, port), ...]
+    nodes = []
+    for node in value.split(','):
+        host, _, port = node.strip().rpartition(':')
+        if host:
+            nodes.append((host, int(port)))
+    return nodes
+
+
+def _redis_mode():
+    if settings.REDIS_MODE not in REDIS_MODES:
+        raise ValueError(f"REDIS_MODE must be one of {', '.join(REDIS_MODES)}, got {settings.REDIS_MODE!r}.")
+    return settings.REDIS_MODE
+
+
+def _connection_kwargs():
+    # Idle connections are checked with a PING before being reused, so connections dropped by the server or a
+    # failover are replaced instead of failing the next command.
+    return {
+        'password': settings.REDIS_PASSWORD or None,
+        'socket_timeout': settings.REDIS_SOCKET_TIMEOUT,
+        'socket_connect_timeout': settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+        'socket_keepalive': True,
+        'health_check_interval': settings.REDIS_HEALTH_CHECK_INTERVAL,
+    }
+
+
+def _sentinel_kwargs():
+    return {
+        'socket_timeout': settings.REDIS_SOCKET_TIMEOUT,
+        'socket_connect_timeout': settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+    }
+
+
+def _cluster_nodes(node_class):
+    nodes = parse_redis_nodes(settings.REDIS_CLUSTER_NODES) or [(settings.REDIS_HOST, int(settings.REDIS_PORT))]
+    return [node_class(host, port) for host, port in nodes]
+
+
+def _track(client):
+    _clients.add(client)
+    return client
+
+
+def create_redis_client():
+    mode = _redis_mode()
+
+    if mode == 'sentinel':
+        sentinel = Sentinel(parse_redis_nodes(settings.REDIS_SENTINELS), sentinel_kwargs=_sentinel_kwargs())
+        return _track(sentinel.master_for(settings.REDIS_SENTINEL_MASTER, redis_class=redis.Redis,
+                                          db=settings.REDIS_DB, max_connections=settings.REDIS_MAX_CONNECTIONS,
+                                          **_connection_kwargs()))
+
+    if mode == 'cluster':
+        return _track(RedisCluster(startup_nodes=_cluster_nodes(ClusterNode),
+                                   max_connections=settings.REDIS_MAX_CONNECTIONS, **_connection_kwargs()))
+
+    return _track(redis.Redis(connection_pool=redis.BlockingConnectionPool(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_DB,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        **_connection_kwargs(),
+    )))
+
+
+def create_async_redis_client():
+    mode = _redis_mode()
+
+    if mode == 'sentinel':
+        sentinel = AsyncSentinel(parse_redis_nodes(settings.REDIS_SENTINELS), sentinel_kwargs=_sentinel_kwargs())
+        return _track(sentinel.master_for(settings.REDIS_SENTINEL_MASTER, redis_class=aioredis.Redis,
+                                          db=settings.REDIS_DB, max_connections=settings.REDIS_MAX_CONNECTIONS,
+                                          **_connection_kwargs()))
+
+    if mode == 'cluster':
+        return _track(AsyncRedisCluster(startup_nodes=_cluster_nodes(AsyncClusterNode),
+                                        max_connections=settings.REDIS_MAX_CONNECTIONS, **_connection_kwargs()))
+
+    return _track(aioredis.Redis(connection_pool=aioredis.BlockingConnectionPool(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_DB,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        **_connection_kwargs(),
+    )))
+
+
+def reset_connection_pools(client):
+    # Forgets the connections without closing them: they are shared with the parent process, which keeps using them.
+    if isinstance(client, RedisCluster):
+        for node in client.get_nodes():
+            if node.redis_connection is not None:
+                node.redis_connection.connection_pool.reset()
+    elif isinstance(client, AsyncRedisCluster):
+        for node in client.get_nodes():
+            node._connections.clear()
+            node._free.clear()
+    elif getattr(client, 'connection_pool', None) is not None:
+        client.connection_pool.reset()
+
+
+def _reset_after_fork():
+    # The clients are created at import time, before gunicorn (--preload) or celery fork their workers. Sync pools
+    # also notice the pid change on first use, asyncio pools and cluster nodes do not.
+    for client in list(_clients):
+        reset_connection_pools(client)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
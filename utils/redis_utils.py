@@ -1,9 +1,11 @@
-import ast
+import struct
 import time
 import redis
 from django.conf import settings
 
-redis_client = redis.StrictRedis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=0)
+from utils.redis_connection_utils import create_redis_client, is_cluster_mode
+
+redis_client = create_redis_client()
 
 RATING_TYPES = {
     "unprocessed": "unprocessed_ratings",
@@ -11,38 +13,490 @@ RATING_TYPES = {
     "normal": "normal_ratings"
 }
 
+RATING_STREAM_KEY = "rating_stream"
+RATING_STREAM_GROUP = "rating_classifiers"
+
+
+# Every script adding or removing queued ratings adjusts the pending ratings counter by the number of hash fields
+# it added or removed, so the backlog is known without scanning the queues.
+# KEYS: rating hash, dirty set, pending ratings counter
+# ARGV: user id, value, article id
+ENQUEUE_RATING_LUA = """
+local added = redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('SADD', KEYS[2], ARGV[3])
+if added > 0 then
+    redis.call('INCRBY', KEYS[3], added)
+end
+return added
+"""
+
+# Copies a rating to a queue unless the user already has one queued there.
+# KEYS: rating hash, pending ratings counter
+# ARGV: user id, value
+REQUEUE_RATING_LUA = """
+local added = redis.call('HSETNX', KEYS[1], ARGV[1], ARGV[2])
+if added > 0 then
+    redis.call('INCRBY', KEYS[2], added)
+end
+return added
+"""
+
+# Classified ratings are written newest first: consumers can classify one user's ratings out of order (stream
+# entries of one user go to different consumers, or an old entry is reclaimed), so a rating is only written if
+# neither classified hash holds a newer one for the user, and the older one is removed from the other hash.
+# queued_at decodes the millisecond timestamp of the values written by encode_rating.
+WRITE_NEWEST_RATING_LUA = """
+local pending = 0
+
+local function queued_at(value)
+    if not value then
+        return nil
+    end
+    local version = string.byte(value, 1)
+    local first, last, unit = 5, 10, 1
+    if version == 2 and #value == 18 then
+        first, last = 11, 18
+    elseif version == 1 and #value == 14 then
+        first, last, unit = 11, 14, 1000
+    elseif version ~= 3 or #value ~= 10 then
+        return tonumber(string.match(value, ',(%d+)$')) * 1000
+    end
+    local timestamp = 0
+    for i = first, last do
+        timestamp = timestamp * 256 + string.byte(value, i)
+    end
+    return timestamp * unit
+end
+
+local function write_newest(hashes, destination, user_id, value, timestamp)
+    for _, key in ipairs(hashes) do
+        local existing = queued_at(redis.call('HGET', key, user_id))
+        if existing and existing > timestamp then
+            return 0
+        end
+    end
+    pending = pending + redis.call('HSET', hashes[destination], user_id, value)
+    pending = pending - redis.call('HDEL', hashes[3 - destination], user_id)
+    return 1
+end
+
+local function update_pending(key)
+    if pending ~= 0 then
+        redis.call('INCRBY', key, pending)
+    end
+end
+"""
+
+# Moves ratings whose queued value is still the one that was classified, so a rating submitted
+# again while the batch was being scored stays queued instead of being overwritten or dropped.
+# KEYS: source hash, normal hash, suspicious hash, dirty normal set, dirty suspicious set, pending ratings counter
+# ARGV: article id, then (user id, expected value, destination 1=normal/2=suspicious, new value,
+# timestamp in milliseconds) per rating
+MOVE_RATINGS_SCRIPT = redis_client.register_script(WRITE_NEWEST_RATING_LUA + """
+local moved = {0, 0}
+for i = 2, #ARGV, 5 do
+    local destination = tonumber(ARGV[i + 2])
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        pending = pending - redis.call('HDEL', KEYS[1], ARGV[i])
+        moved[destination] = moved[destination] +
+            write_newest({KEYS[2], KEYS[3]}, destination, ARGV[i], ARGV[i + 3], tonumber(ARGV[i + 4]))
+    end
+end
+for destination = 1, 2 do
+    if moved[destination] > 0 then
+        redis.call('SADD', KEYS[3 + destination], ARGV[1])
+    end
+end
+update_pending(KEYS[6])
+return moved[1] + moved[2]
+""")
+
+# KEYS: normal hash, suspicious hash, dirty normal set, dirty suspicious set, pending ratings counter
+# ARGV: article id, then (user id, destination 1=normal/2=suspicious, value, timestamp in milliseconds) per rating
+WRITE_CLASSIFIED_RATINGS_SCRIPT = redis_client.register_script(WRITE_NEWEST_RATING_LUA + """
+local written = {0, 0}
+for i = 2, #ARGV, 4 do
+    local destination = tonumber(ARGV[i + 1])
+    written[destination] = written[destination] +
+        write_newest({KEYS[1], KEYS[2]}, destination, ARGV[i], ARGV[i + 2], tonumber(ARGV[i + 3]))
+end
+for destination = 1, 2 do
+    if written[destination] > 0 then
+        redis.call('SADD', KEYS[2 + destination], ARGV[1])
+    end
+end
+update_pending(KEYS[5])
+return written[1] + written[2]
+""")
+
+# Deletes ratings only if their queued value is unchanged.
+# KEYS: rating hash, pending ratings counter
+# ARGV: (user id, expected value) per rating
+DELETE_RATINGS_SCRIPT = redis_client.register_script("""
+local deleted = 0
+for i = 1, #ARGV, 2 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        deleted = deleted + redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+if deleted > 0 then
+    redis.call('DECRBY', KEYS[2], deleted)
+end
+return deleted
+""")
+
+
+# Drops every queue of an article, e.g. once the article was deleted.
+# KEYS: rating hashes, then the pending ratings counter
+DROP_RATINGS_SCRIPT = redis_client.register_script("""
+local dropped = 0
+for i = 1, #KEYS - 1 do
+    dropped = dropped + redis.call('HLEN', KEYS[i])
+    redis.call('DEL', KEYS[i])
+end
+if dropped > 0 then
+    redis.call('DECRBY', KEYS[#KEYS], dropped)
+end
+return dropped
+""")
+
+# Moves the dirty articles of a shard to its processing set and returns them, with the articles left there by a
+# worker that was killed before committing them.
+# KEYS: dirty set, processing set
+CLAIM_DIRTY_ARTICLES_SCRIPT = redis_client.register_script("""
+redis.call('SUNIONSTORE', KEYS[2], KEYS[1], KEYS[2])
+redis.call('DEL', KEYS[1])
+return redis.call('SMEMBERS', KEYS[2])
+""")
+
+
+def get_article_shard(article_id):
+    return int(article_id) % settings.RATING_TASK_SHARDS
+
+
+def _shard_tag(shard):
+    # In cluster mode the rating hashes and dirty sets of a shard share a hash slot, so the move script and the
+    # pipelines queueing a rating and marking its article dirty only touch one node, in order.
+    return f"{{{shard}}}:" if is_cluster_mode() else ""
+
+
+def get_ratings_key(article_id, rating_type='unprocessed'):
+    return f"{RATING_TYPES.get(rating_type)}:{_shard_tag(get_article_shard(article_id))}{article_id}"
+
+
+def get_dirty_articles_key(rating_type, shard=0):
+    return f"dirty_{RATING_TYPES.get(rating_type)}:{_shard_tag(shard)}{shard}"
+
+
+def get_processing_articles_key(rating_type, shard=0):
+    return f"processing_{RATING_TYPES.get(rating_type)}:{_shard_tag(shard)}{shard}"
+
+
+def get_pending_ratings_key(shard=0):
+    # A single counter, or one per shard in cluster mode so the scripts only touch the hash slot of the shard.
+    return f"pending_ratings:{_shard_tag(shard)}{shard}" if is_cluster_mode() else "pending_ratings"
+
+
+def get_pending_ratings_keys():
+    if not is_cluster_mode():
+        return [get_pending_ratings_key()]
+    return [get_pending_ratings_key(shard) for shard in range(settings.RATING_TASK_SHARDS)]
+
+
+def _article_pending_ratings_key(article_id):
+    return get_pending_ratings_key(get_article_shard(article_id))
+
+
+def get_rating_task_lock(rating_type, shard=0):
+    return redis_client.lock(f"rating_task_lock:{RATING_TYPES.get(rating_type)}:{shard}",
+                             timeout=settings.RATING_TASK_LOCK_TIMEOUT)
+
+
+# Version 3 rating values: version, score, suspicion factor in 1/10000 steps and timestamp in milliseconds, packed
+# into 10 bytes, the timestamp as its high 16 and low 32 bits. Version 2 values hold the suspicion factor as a double
+# and the timestamp in 8 bytes, version 1 values hold the timestamp in seconds. Values queued before the binary
+# format are "score,suspicion_factor,timestamp" strings, which start with an ASCII digit and so never collide with
+# the version byte. Timestamps are decoded to seconds.
+RATING_FORMAT_VERSION = 3
+RATING_STRUCT = struct.Struct('!BBHHI')
+RATING_STRUCT_V2 = struct.Struct('!BBdQ')
+RATING_STRUCT_V1 = struct.Struct('!BBdI')
+SUSPICION_SCALE = 10000
+
+
+def _timestamp_ms(timestamp):
+    return int(round(timestamp * 1000))
+
+
+def encode_rating(score, suspicion_factor, timestamp):
+    suspicion = min(max(int(round(suspicion_factor * SUSPICION_SCALE)), 0), 0xffff)
+    timestamp = _timestamp_ms(timestamp)
+    return RATING_STRUCT.pack(RATING_FORMAT_VERSION, int(score), suspicion, timestamp >> 32, timestamp & 0xffffffff)
+
+
+def decode_rating(raw):
+    if len(raw) == RATING_STRUCT.size and raw[0] == RATING_FORMAT_VERSION:
+        _, score, suspicion, timestamp_high, timestamp_low = RATING_STRUCT.unpack(raw)
+        suspicion_factor = suspicion / SUSPICION_SCALE
+        timestamp = ((timestamp_high << 32) + timestamp_low) / 1000
+    elif len(raw) == RATING_STRUCT_V2.size and raw[0] == 2:
+        _, score, suspicion_factor, timestamp = RATING_STRUCT_V2.unpack(raw)
+        timestamp /= 1000
+    elif len(raw) == RATING_STRUCT_V1.size and raw[0] == 1:
+        _, score, suspicion_factor, timestamp = RATING_STRUCT_V1.unpack(raw)
+    else:
+        score, suspicion_factor, timestamp = raw.decode('utf-8').split(',')
+        score, suspicion_factor, timestamp = int(score), float(suspicion_factor), int(timestamp)
+
+    return {'score': score, 'suspicion_factor': suspicion_factor, 'timestamp': timestamp, 'raw': raw}
+
+
+def decode_ratings(ratings_data):
+    return {int(user_id): decode_rating(raw) for user_id, raw in ratings_data.items()}
+
 
 def add_rating_to_redis(article_id, user_id, score, rating_type='unprocessed', suspicion_factor=0.0):
-    timestamp = int(time.time())
-    key = f"{RATING_TYPES.get(rating_type)}:{article_id}"
-    value = f"{score},{suspicion_factor},{timestamp}"
-    redis_client.hset(key, user_id, value)
+    timestamp = time.time()
+    if rating_type != 'unprocessed':
+        rating_data = {'score': score, 'timestamp': timestamp}
+        add_classified_ratings_to_redis(article_id, [(user_id, rating_data, rating_type, suspicion_factor)])
+        return
+
+    _queue_rating(redis_client, article_id, user_id, encode_rating(score, suspicion_factor, timestamp))
+
+
+def _queue_rating(client, article_id, user_id, value):
+    # EVAL instead of a registered script, so it can be buffered in sync, asyncio and cluster pipelines alike.
+    keys = [
+        get_ratings_key(article_id, 'unprocessed'),
+        get_dirty_articles_key('unprocessed', get_article_shard(article_id)),
+        _article_pending_ratings_key(article_id),
+    ]
+    return client.eval(ENQUEUE_RATING_LUA, len(keys), *keys, user_id, value, article_id)
+
+
+def queue_ratings(pipe, user_id, ratings):
+    # ratings: (article_id, score) pairs. Commands are only buffered, so this works for sync and asyncio pipelines.
+    timestamp = time.time()
+    for article_id, score in ratings:
+        if settings.RATING_INGEST_MODE == 'stream':
+            fields = {'article': article_id, 'user': user_id, 'score': score, 'timestamp': int(timestamp)}
+            pipe.xadd(RATING_STREAM_KEY, fields, maxlen=settings.RATING_STREAM_MAXLEN, approximate=True)
+        else:
+            _queue_rating(pipe, article_id, user_id, encode_rating(score, 0.0, timestamp))
+    return pipe
+
+
+def enqueue_ratings(user_id, ratings):
+    queue_ratings(redis_client.pipeline(), user_id, ratings).execute()
+
+
+def enqueue_rating(article_id, user_id, score):
+    enqueue_ratings(user_id, [(article_id, score)])
+
+
+def ensure_rating_stream_group():
+    try:
+        redis_client.xgroup_create(RATING_STREAM_KEY, RATING_STREAM_GROUP, id='0', mkstream=True)
+    except redis.ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+def read_rating_stream(consumer, count):
+    # Entries another consumer read but never acknowledged (e.g. its worker died) are claimed first.
+    _, entries, *_ = redis_client.xautoclaim(RATING_STREAM_KEY, RATING_STREAM_GROUP, consumer,
+                                             min_idle_time=settings.RATING_STREAM_CLAIM_IDLE_MS,
+                                             start_id='0-0', count=count)
+    entries = [entry for entry in entries if entry and entry[1]]
+
+    if len(entries) < count:
+        for _, messages in redis_client.xreadgroup(RATING_STREAM_GROUP, consumer, {RATING_STREAM_KEY: '>'},
+                                                   count=count - len(entries)):
+            entries.extend(messages)
+
+    # Entry ids start with the time Redis appended the entry in milliseconds, which orders one user's ratings
+    # more precisely than the timestamp field.
+    ratings = []
+    for entry_id, fields in entries:
+        ratings.append((entry_id, {
+            'article': int(fields[b'article']),
+            'user': int(fields[b'user']),
+            'score': int(fields[b'score']),
+            'timestamp': int(entry_id.split(b'-')[0]) / 1000,
+        }))
+
+    return ratings
+
+
+def ack_rating_stream(entry_ids):
+    if entry_ids:
+        pipe = redis_client.pipeline()
+        pipe.xack(RATING_STREAM_KEY, RATING_STREAM_GROUP, *entry_ids)
+        pipe.xdel(RATING_STREAM_KEY, *entry_ids)
+        pipe.execute()
+
+
+def mark_articles_dirty(article_ids, rating_type='unprocessed'):
+    if article_ids:
+        pipe = redis_client.pipeline(transaction=False)
+        for article_id in article_ids:
+            pipe.sadd(get_dirty_articles_key(rating_type, get_article_shard(article_id)), article_id)
+        pipe.execute()
+
+
+def claim_dirty_articles(rating_type='unprocessed', shard=0):
+    # Claimed articles stay in the processing set until finish_dirty_articles, so they are not lost if the worker
+    # dies. Ratings queued meanwhile mark the article dirty again.
+    keys = [get_dirty_articles_key(rating_type, shard), get_processing_articles_key(rating_type, shard)]
+    return sorted(int(article_id) for article_id in CLAIM_DIRTY_ARTICLES_SCRIPT(keys=keys))
+
+
+def finish_dirty_articles(rating_type, shard, article_ids):
+    if article_ids:
+        redis_client.srem(get_processing_articles_key(rating_type, shard), *article_ids)
+
+
+def count_dirty_articles(rating_type='unprocessed'):
+    # Articles still claimed by a worker that died count too, so their shard is dispatched again.
+    pipe = redis_client.pipeline(transaction=False)
+    for shard in range(settings.RATING_TASK_SHARDS):
+        pipe.scard(get_dirty_articles_key(rating_type, shard))
+        pipe.scard(get_processing_articles_key(rating_type, shard))
+    counts = pipe.execute()
+    return [dirty + processing for dirty, processing in zip(counts[::2], counts[1::2])]
+
+
+def _requeue_ratings(key, article_id, rating_type):
+    # Cluster mode only: the queue is tagged with the shard the article had before RATING_TASK_SHARDS changed. The
+    # old and current keys are in different hash slots, so the ratings are copied one by one, keeping the newest
+    # rating of each user, and then deleted from the old queue if unchanged.
+    ratings = decode_ratings(redis_client.hgetall(key))
+    if rating_type == 'unprocessed':
+        # Ratings already queued under the current key were submitted after the change, so they are newer.
+        for user_id, rating_data in ratings.items():
+            redis_client.eval(REQUEUE_RATING_LUA, 2, get_ratings_key(article_id, rating_type),
+                              _article_pending_ratings_key(article_id), user_id, rating_data['raw'])
+    else:
+        classified_ratings = [(user_id, rating_data, rating_type, rating_data['suspicion_factor'])
+                              for user_id, rating_data in ratings.items()]
+        add_classified_ratings_to_redis(article_id, classified_ratings)
+
+    old_shard = int(key.split(':')[1].strip('{}'))
+    args = [value for user_id, rating_data in ratings.items() for value in (user_id, rating_data['raw'])]
+    if args:
+        DELETE_RATINGS_SCRIPT(keys=[key, get_pending_ratings_key(old_shard)], args=args)
+
+
+def mark_pending_articles_dirty():
+    # Moves queues left under an old shard tag, marks every queued article dirty and recounts the pending ratings,
+    # e.g. for ratings queued before the counter existed. Ratings queued or processed while the queues are scanned
+    # can make the counter drift by that many ratings.
+    marked = 0
+    pending = {key: 0 for key in get_pending_ratings_keys()}
+    for rating_type, prefix in RATING_TYPES.items():
+        queues = {}
+        for key in redis_client.scan_iter(match=f"{prefix}:*"):
+            key = key.decode('utf-8')
+            article_id = int(key.rsplit(':', 1)[1])
+            queues[article_id] = get_ratings_key(article_id, rating_type)
+            if key != queues[article_id]:
+                _requeue_ratings(key, article_id, rating_type)
+
+        for article_id, key in queues.items():
+            pending_key = _article_pending_ratings_key(article_id)
+            pending[pending_key] = pending.get(pending_key, 0) + redis_client.hlen(key)
+        mark_articles_dirty(list(queues), rating_type)
+        marked += len(queues)
+
+    for key, count in pending.items():
+        redis_client.set(key, count)
+    return marked
+
+
+def queue_pending_rating_counts(pipe):
+    # Buffers the commands counting the ratings waiting in Redis: stream entries not classified yet and the ratings
+    # in the rating hashes. Commands are only buffered, so this works for sync and asyncio pipelines.
+    pipe.xlen(RATING_STREAM_KEY)
+    for key in get_pending_ratings_keys():
+        pipe.get(key)
+    return pipe
+
+
+def sum_pending_rating_counts(counts):
+    return max(sum(int(count or 0) for count in counts), 0)
 
 
 def get_user_rating_from_redis(article_id, user_id, rating_type='unprocessed'):
-    key = f"{RATING_TYPES.get(rating_type)}:{article_id}"
+    key = get_ratings_key(article_id, rating_type)
     rating = redis_client.hget(key, user_id)
-    return int(rating) if rating else None
+    return decode_rating(rating)['score'] if rating else None
 
 
 def delete_user_rating_from_redis(article_id, user_id, rating_type='unprocessed'):
-    key = f"{RATING_TYPES.get(rating_type)}:{article_id}"
-    redis_client.hdel(key, user_id)
+    raw = redis_client.hget(get_ratings_key(article_id, rating_type), user_id)
+    if raw is not None:
+        delete_ratings_from_redis(article_id, [(user_id, {'raw': raw})], rating_type)
 
 
 def get_ratings_from_redis(article_id, rating_type='unprocessed'):
-    key = f"{RATING_TYPES.get(rating_type)}:{article_id}"
-    ratings_data = redis_client.hgetall(key)
+    key = get_ratings_key(article_id, rating_type)
+    return decode_ratings(redis_client.hgetall(key))
 
-    ratings = {}
-    for user_id, data in ratings_data.items():
-        data = data.decode('utf-8')
-        score, suspicion_factor, timestamp = data.split(',')
 
-        ratings[user_id] = {
-            'score': int(ast.literal_eval(score)),
-            'suspicion_factor': float(suspicion_factor),
-            'timestamp': int(timestamp)
-        }
+def move_classified_ratings_in_redis(article_id, classified_ratings):
+    args = [article_id]
+    for user_id, rating_data, rating_type, suspicion_factor in classified_ratings:
+        destination = 2 if rating_type == 'suspicious' else 1
+        value = encode_rating(rating_data['score'], suspicion_factor, rating_data['timestamp'])
+        args.extend([user_id, rating_data['raw'], destination, value, _timestamp_ms(rating_data['timestamp'])])
 
-    return ratings
+    if len(args) == 1:
+        return 0
+
+    keys = [
+        get_ratings_key(article_id, 'unprocessed'),
+        get_ratings_key(article_id, 'normal'),
+        get_ratings_key(article_id, 'suspicious'),
+        get_dirty_articles_key('normal', get_article_shard(article_id)),
+        get_dirty_articles_key('suspicious', get_article_shard(article_id)),
+        _article_pending_ratings_key(article_id),
+    ]
+    return MOVE_RATINGS_SCRIPT(keys=keys, args=args)
+
+
+def add_classified_ratings_to_redis(article_id, classified_ratings):
+    args = [article_id]
+    for user_id, rating_data, rating_type, suspicion_factor in classified_ratings:
+        destination = 2 if rating_type == 'suspicious' else 1
+        value = encode_rating(rating_data['score'], suspicion_factor, rating_data['timestamp'])
+        args.extend([user_id, destination, value, _timestamp_ms(rating_data['timestamp'])])
+
+    if len(args) == 1:
+        return 0
+
+    keys = [
+        get_ratings_key(article_id, 'normal'),
+        get_ratings_key(article_id, 'suspicious'),
+        get_dirty_articles_key('normal', get_article_shard(article_id)),
+        get_dirty_articles_key('suspicious', get_article_shard(article_id)),
+        _article_pending_ratings_key(article_id),
+    ]
+    return WRITE_CLASSIFIED_RATINGS_SCRIPT(keys=keys, args=args)
+
+
+def delete_ratings_from_redis(article_id, ratings, rating_type='unprocessed'):
+    args = []
+    for user_id, rating_data in ratings:
+        args.extend([user_id, rating_data['raw']])
+
+    if not args:
+        return 0
+
+    keys = [get_ratings_key(article_id, rating_type), _article_pending_ratings_key(article_id)]
+    return DELETE_RATINGS_SCRIPT(keys=keys, args=args)
+
+
+def drop_article_ratings_from_redis(article_id):
+    keys = [get_ratings_key(article_id, rating_type) for rating_type in RATING_TYPES]
+    return DROP_RATINGS_SCRIPT(keys=[*keys, _article_pending_ratings_key(article_id)])
@@ -0,0 +1,39 @@
+import math
+
+SCORES = range(6)
+
+
+# Count, mean and standard deviation are derived from one counter per score, so they cost the same
+# no matter how many ratings were added, and distributions of several time buckets can be merged.
+class ScoreDistribution:
+    def __init__(self, counts=None):
+        self.counts = list(counts) if counts is not None else [0] * len(SCORES)
+
+    def add(self, score, count=1):
+        self.counts[score] += count
+
+    def merge(self, other):
+        for score in SCORES:
+            self.counts[score] += other.counts[score]
+        return self
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    @property
+    def mean(self):
+        count = self.count
+        if count <= 0:
+            return 0.0
+        return sum(score * self.counts[score] for score in SCORES) / count
+
+    @property
+    def std(self):
+        count = self.count
+        if count <= 0:
+            return 0.0
+        mean = self.mean
+        variance = sum(self.counts[score] * (score - mean) ** 2 for score in SCORES) / count
+        # Counters adjusted below zero (e.g. [-1, 0, 0, 0, 0, 2]) can make the variance negative.
+        return math.sqrt(max(variance, 0.0))